@@ -10,24 +10,118 @@ These handlers ensure secure voter authentication before allowing voting access.
 """
 
 import os
+import hmac
 import uuid
 import json
 import logging
-import random
+import secrets
 import base64
-from datetime import datetime, timedelta
+import threading
+import time
 
-from flask import jsonify, request
+import redis
+from cachetools import TTLCache
+from flask import request
+
+from json_utils import jsonify, now_iso
 
 # Configure logging
 logger = logging.getLogger("facial-auth-api")
 
-# In-memory storage for OTPs during development
-otp_storage = {}
+# OTPs expire after 10 minutes
+OTP_TTL_SECONDS = 600
+
+# OTPs live in Redis so every gunicorn worker sees the same state
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Short timeouts so an unreachable Redis host can't hang the import or a request
+redis_pool = redis.ConnectionPool.from_url(REDIS_URL, max_connections=50, decode_responses=True,
+                                           socket_connect_timeout=1, socket_timeout=1)
+redis_client = redis.Redis(connection_pool=redis_pool)
+# Seconds to wait before trying Redis again after a failure
+REDIS_RETRY_SECONDS = 5
+redis_down_until = 0.0  # time.monotonic() before which Redis is skipped
+
+# Fallback used only while Redis is unreachable; the cache bound keeps memory flat under load
+otp_storage = TTLCache(maxsize=10000, ttl=OTP_TTL_SECONDS)
+otp_lock = threading.Lock()  # TTLCache is not thread-safe
+
+def redis_available():
+    """Whether to try Redis: true unless it failed within the last REDIS_RETRY_SECONDS."""
+    return time.monotonic() >= redis_down_until
+
+def mark_redis_down(error):
+    """Fall back to process memory until the retry interval has passed."""
+    global redis_down_until
+    redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+    logger.warning(f"Redis not reachable at {REDIS_URL}, keeping OTPs in process memory: {str(error)}")
+
+try:
+    redis_client.ping()
+except redis.exceptions.RedisError as e:  # Includes TimeoutError, which is not a ConnectionError
+    mark_redis_down(e)
+
+def store_otp(voter_key, otp):
+    """Store a new OTP for the voter, clearing any earlier verification."""
+    if redis_available():
+        try:
+            pipe = redis_client.pipeline()
+            pipe.set(f"otp:{voter_key}", otp, ex=OTP_TTL_SECONDS)
+            pipe.delete(f"otp_verified:{voter_key}")
+            pipe.execute()
+            with otp_lock:
+                # Drop any OTP kept in memory during an outage so it can't be verified later
+                otp_storage.pop(voter_key, None)
+            return
+        except redis.exceptions.RedisError as e:
+            mark_redis_down(e)
+    with otp_lock:
+        otp_storage[voter_key] = {
+            'otp': otp,
+            'verified': False
+        }
+
+def get_otp(voter_key):
+    """Return the pending OTP for the voter, or None if there is none or it expired."""
+    if redis_available():
+        try:
+            otp = redis_client.get(f"otp:{voter_key}")
+            if otp is not None:
+                return otp
+        except redis.exceptions.RedisError as e:
+            mark_redis_down(e)
+    # Also covers OTPs stored in memory during an outage that has since ended
+    with otp_lock:
+        otp_data = otp_storage.get(voter_key)
+    return otp_data['otp'] if otp_data else None
+
+def mark_otp_verified(voter_key):
+    """Record that the voter passed the OTP step."""
+    if redis_available():
+        try:
+            redis_client.set(f"otp_verified:{voter_key}", 1, ex=OTP_TTL_SECONDS)
+        except redis.exceptions.RedisError as e:
+            mark_redis_down(e)
+    with otp_lock:
+        otp_data = otp_storage.get(voter_key)
+        if otp_data:
+            # Mutating in place keeps the original expiry
+            otp_data['verified'] = True
+
+def is_otp_verified(voter_key):
+    """Check whether the voter passed the OTP step."""
+    if redis_available():
+        try:
+            if redis_client.get(f"otp_verified:{voter_key}") is not None:
+                return True
+        except redis.exceptions.RedisError as e:
+            mark_redis_down(e)
+    with otp_lock:
+        otp_data = otp_storage.get(voter_key, {})
+    return otp_data.get('verified', False)
 
 def register_endpoints(app, api_auth_required, voter_database, get_voter_key, 
                        extract_face_from_image, verify_voter_by_face, 
-                       get_face_embedding, register_voter, TEMP_DIR):
+                       get_face_embedding, register_voter, TEMP_DIR, save_debug_face, write_jpeg):
     """Register authentication endpoints with the Flask app."""
     
     @app.route('/api/auth/verify-credentials', methods=['POST'])
@@ -54,15 +148,11 @@ def register_endpoints(app, api_auth_required, voter_database, get_voter_key,
             voter_key = get_voter_key(aadhar, voter_id)
             found_in_db = voter_key in voter_database
             
-            # Generate a random 6-digit OTP
-            otp = ''.join(random.choices('0123456789', k=6))
+            # Generate a random 6-digit OTP from the OS CSPRNG
+            otp = f"{secrets.randbelow(1000000):06d}"
             
             # Store OTP for verification
-            otp_storage[voter_key] = {
-                'otp': otp,
-                'created_at': datetime.now().isoformat(),
-                'verified': False
-            }
+            store_otp(voter_key, otp)
             
             # In a production system, send OTP via SMS to the mobile number
             # For development/testing, we'll just return it in the response
@@ -101,34 +191,24 @@ def register_endpoints(app, api_auth_required, voter_database, get_voter_key,
             voter_key = get_voter_key(aadhar, voter_id)
             
             # Check OTP
-            otp_data = otp_storage.get(voter_key)
+            stored_otp = get_otp(voter_key)
             
-            if not otp_data:
+            if not stored_otp:
+                # Expired OTPs are evicted by Redis or the cache
                 return jsonify({
                     "verified": False,
-                    "error": "No OTP request found for this voter"
+                    "error": "No OTP request found for this voter or OTP has expired"
                 }), 400
             
-            # Check if OTP matches
-            if otp_data['otp'] != otp:
+            # Check if OTP matches (constant-time to avoid a timing side channel)
+            if not hmac.compare_digest(stored_otp.encode(), str(otp).encode()):
                 return jsonify({
                     "verified": False,
                     "error": "Invalid OTP"
                 }), 400
             
-            # Calculate time since OTP generation (for expiration check)
-            created_at = datetime.fromisoformat(otp_data['created_at'])
-            time_elapsed = (datetime.now() - created_at).total_seconds() / 60  # minutes
-            
-            if time_elapsed > 10:  # OTP expired after 10 minutes
-                return jsonify({
-                    "verified": False,
-                    "error": "OTP has expired"
-                }), 400
-            
             # Mark as verified
-            otp_data['verified'] = True
-            otp_storage[voter_key] = otp_data
+            mark_otp_verified(voter_key)
             
             return jsonify({
                 "verified": True,
@@ -163,8 +243,7 @@ def register_endpoints(app, api_auth_required, voter_database, get_voter_key,
             voter_key = get_voter_key(aadhar, voter_id)
             
             # Check OTP verification
-            otp_data = otp_storage.get(voter_key, {})
-            if not otp_data.get('verified', False):
+            if not is_otp_verified(voter_key):
                 return jsonify({
                     "verified": False,
                     "error": "OTP verification required before face verification",
@@ -179,11 +258,8 @@ def register_endpoints(app, api_auth_required, voter_database, get_voter_key,
             # Generate a unique ID for this verification
             verification_id = str(uuid.uuid4())
             
-            # Save the processed face temporarily (for debugging)
+            # TEMP_DIR is created at startup
             temp_path = os.path.join(TEMP_DIR, f"voter_verify_{verification_id}.jpg")
-            os.makedirs(os.path.dirname(temp_path), exist_ok=True)
-            import cv2
-            cv2.imwrite(temp_path, face_img)
             
             # Verify the voter
             verified, details = verify_voter_by_face(aadhar, voter_id, face_img)
@@ -191,6 +267,8 @@ def register_endpoints(app, api_auth_required, voter_database, get_voter_key,
             # If first time (not found in DB), register this voter
             if voter_key not in voter_database and not verified:
                 logger.info(f"New voter registration: {voter_key[:8]}...")
+                # The saved face becomes the voter's reference image
+                write_jpeg(temp_path, face_img)
                 # Register the voter for future verifications
                 register_voter(aadhar, voter_id, get_face_embedding(face_img), temp_path)
                 verified = True
@@ -200,11 +278,14 @@ def register_endpoints(app, api_auth_required, voter_database, get_voter_key,
                     "voter_id": voter_id,
                     "newly_registered": True
                 }
+            else:
+                # Save the processed face (debugging only; a no-op unless enabled)
+                save_debug_face(temp_path, face_img)
             
             response = {
                 "verified": verified,
                 "details": details,
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": now_iso(),
                 "verification_id": verification_id
             }
             
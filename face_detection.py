@@ -0,0 +1,44 @@
+"""
+YuNet face detector setup shared by the server and image_manager
+
+Picks the model file, DNN backend and target the same way in both, so
+reference images are cropped by the detector that crops probe faces.
+"""
+
+import os
+
+import cv2
+import numpy as np
+
+
+def get_face_detector_config(model_path, cpu_fp16=False):
+    """(model path, backend, target) for YuNet, or None when the detector is unavailable."""
+    root, ext = os.path.splitext(model_path)
+    int8_path = f"{root}_int8{ext}"
+    if not hasattr(cv2, 'FaceDetectorYN') or not (os.path.exists(model_path) or os.path.exists(int8_path)):
+        return None
+
+    # Run on the GPU when OpenCV was built with CUDA
+    backend, target = cv2.dnn.DNN_BACKEND_OPENCV, cv2.dnn.DNN_TARGET_CPU
+    if hasattr(cv2, 'cuda') and cv2.cuda.getCudaEnabledDeviceCount() > 0 and os.path.exists(model_path):
+        backend, target = cv2.dnn.DNN_BACKEND_CUDA, cv2.dnn.DNN_TARGET_CUDA
+    elif os.path.exists(int8_path):
+        # The CPU backend runs the INT8 YuNet (e.g. face_detection_yunet_2023mar_int8.onnx) with VNNI dot products
+        model_path = int8_path
+    elif cpu_fp16 and hasattr(cv2.dnn, 'DNN_TARGET_CPU_FP16'):
+        # Half-precision CPU kernels (OpenCV 4.10+); OpenCV uses FP32 where the CPU lacks FP16 arithmetic
+        target = cv2.dnn.DNN_TARGET_CPU_FP16
+    return model_path, backend, target
+
+
+def create_face_detector(model_path, cpu_fp16=False):
+    """Create and warm up a YuNet face detector, or return None to use the Haar cascade."""
+    config = get_face_detector_config(model_path, cpu_fp16)
+    if config is None:
+        return None
+    model_path, backend, target = config
+    face_detector = cv2.FaceDetectorYN.create(model_path, "", (320, 320), score_threshold=0.6,
+                                              backend_id=backend, target_id=target)
+    # Warm up so network allocation doesn't land on the first detection
+    face_detector.detect(np.zeros((320, 320, 3), dtype=np.uint8))
+    return face_detector
@@ -11,39 +11,71 @@ Usage:
 
 import os
 import sys
-import json
-import base64
+import argparse
+import pybase64
 import logging
 import uuid
 import requests
-import hashlib
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import blake3
+import hmac
+import mmap
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from functools import wraps
+from contextlib import closing
+from functools import lru_cache, wraps
 import sqlite3
 from dotenv import load_dotenv
 import face_recognition
 from werkzeug.security import generate_password_hash, check_password_hash
 import time
+from cachetools import LRUCache
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
 load_dotenv()
 
 try:
-    from flask import Flask, request, jsonify, Response
+    from flask import Flask, request, Response
+    import orjson
+    from json_utils import OrjsonRequest, jsonify, now_iso
+    from metadata_store import MetadataStore
+    import face_detection
     from flask_cors import CORS
     import cv2
     import numpy as np
     from PIL import Image
-    import tensorflow as tf
-    from tensorflow.keras.models import Sequential, Model, load_model
-    from tensorflow.keras.layers import ZeroPadding2D, Convolution2D, MaxPooling2D
-    from tensorflow.keras.layers import Dense, Dropout, Flatten, Activation, BatchNormalization
 except ImportError as e:
     print(f"Required libraries not found: {str(e)}")
     print("Please install with: pip install -r requirements.txt")
     sys.exit(1)
 
+# Optional accelerators
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+try:
+    from turbojpeg import TurboJPEG, TJFLAG_FASTDCT, TJPF_BGR, TJPF_RGB
+    turbo_jpeg = TurboJPEG()
+except (ImportError, RuntimeError):  # RuntimeError: libturbojpeg not found
+    turbo_jpeg = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -58,6 +90,7 @@ logger = logging.getLogger(__name__)
 
 # Initialize Flask app
 app = Flask(__name__)
+app.request_class = OrjsonRequest # Parse request bodies with orjson
 # Configure CORS properly to allow requests from the frontend origin
 CORS(app, resources={r"/api/*": {"origins": ["http://localhost:8000", "http://127.0.0.1:8000"]}}, supports_credentials=True)
 
@@ -96,9 +129,8 @@ def not_found_error(e):
 def health_check():
     try:
         # Check database connection
-        conn = get_db_connection()
-        conn.close()
-        return jsonify({"status": "healthy", "timestamp": datetime.now().isoformat()}), 200
+        get_db_connection().execute('SELECT 1')
+        return jsonify({"status": "healthy", "timestamp": now_iso()}), 200
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}")
         return jsonify({"status": "unhealthy", "error": str(e)}), 500
@@ -106,10 +138,39 @@ def health_check():
 # App configuration
 app.config['IMAGES_DIR'] = "images/users"
 app.config['REFERENCE_IMAGE_PATH'] = os.path.join(app.config['IMAGES_DIR'], "Screenshot 2024-06-18 203605.png") # Specific image for voting comparison
-app.config['METADATA_FILE'] = f"{app.config['IMAGES_DIR']}/metadata.json"
+app.config['METADATA_DB'] = f"{app.config['IMAGES_DIR']}/metadata.db" # Users and reference images
+app.config['METADATA_FILE'] = f"{app.config['IMAGES_DIR']}/metadata.json" # Legacy metadata, imported once into METADATA_DB
 app.config['TEMP_DIR'] = "images/temp"
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("MAX_UPLOAD_MB", "16")) * 1024 * 1024  # Larger request bodies are rejected with 413
+app.config['MAX_DECODE_SIDE'] = int(os.getenv("MAX_DECODE_SIDE", "1280"))  # JPEGs larger than this are decoded at reduced scale
 app.config['MODEL_DIR'] = "models"
+app.config['TF_XLA'] = os.getenv("TF_XLA", "true").lower() == "true"  # XLA-compile the Keras forward pass
+app.config['TF_MIXED_PRECISION'] = os.getenv("TF_MIXED_PRECISION", "auto").lower()  # "auto" enables float16 compute when a GPU is present
+app.config['FACE_DETECTOR_MODEL'] = os.getenv("FACE_DETECTOR_MODEL", os.path.join(app.config['MODEL_DIR'], "face_detection_yunet_2023mar.onnx")) # YuNet ONNX detector, Haar cascade is the fallback
+app.config['DETECTOR_POOL_SIZE'] = int(os.getenv("DETECTOR_POOL_SIZE", int(os.getenv("GUNICORN_THREADS", "8")) + (os.cpu_count() or 4)))  # Detectors warmed at startup: one per request thread and I/O pool thread
+app.config['DETECTOR_CPU_FP16'] = os.getenv("DETECTOR_CPU_FP16", "false").lower() == "true"  # Run the float YuNet with FP16 CPU kernels (ARMv8.2+ hosts)
+app.config['ONNX_MODEL_PATH'] = os.getenv("FACE_ONNX_MODEL", os.path.join(app.config['MODEL_DIR'], "w600k_mbf.onnx")) # Pretrained MobileFaceNet/ArcFace, preferred over the Keras model
+app.config['FACE_MODEL_INT8'] = os.getenv("FACE_MODEL_INT8", "true").lower() == "true"  # Serve the INT8 copy of the ONNX model once --prepare-face-model has calibrated it
+app.config['INT8_MIN_CALIBRATION_IMAGES'] = 50  # Below this the FP32/FP16 model is kept
+app.config['ORT_TENSORRT'] = os.getenv("ORT_TENSORRT", "true").lower() == "true"  # Run the ONNX model as a TensorRT FP16 engine when available
+app.config['TRT_CACHE_DIR'] = os.path.join(app.config['MODEL_DIR'], "trt_cache") # Built TensorRT engines, reused across restarts
+app.config['ORT_CUDA'] = os.getenv("ORT_CUDA", "true").lower() == "true"  # Use the CUDA provider on GPU boxes
+app.config['ORT_OPENVINO_DEVICE'] = os.getenv("ORT_OPENVINO_DEVICE", "CPU_FP32")  # OpenVINO target on Intel hosts, e.g. GPU_FP16 for the iGPU; empty disables
+app.config['OPENVINO_CACHE_DIR'] = os.path.join(app.config['MODEL_DIR'], "openvino_cache") # Compiled OpenVINO blobs, reused across restarts
+app.config['EMBED_BATCH_MAX'] = int(os.getenv("EMBED_BATCH_MAX", "16"))  # Most probe faces coalesced into one model call
+app.config['EMBED_BATCH_TIMEOUT_MS'] = float(os.getenv("EMBED_BATCH_TIMEOUT_MS", "5"))  # How long the first face waits for others to join its batch
+app.config['VOTER_BATCH_MAX'] = int(os.getenv("VOTER_BATCH_MAX", "64"))  # Max voters per /api/voters/batch request
 app.config['VERIFICATION_THRESHOLD'] = 0.6  # Adjust this threshold based on testing
+app.config['VOTER_DB_PATH'] = os.getenv("VOTER_DB_PATH", os.path.join(app.config['MODEL_DIR'], "voters.db")) # Registered voters and their embeddings
+app.config['REFERENCE_INDEX_PATH'] = os.path.join(app.config['MODEL_DIR'], "reference_index") # Base path, extension added per backend
+app.config['GALLERY_DTYPE'] = os.getenv("GALLERY_DTYPE", "float16")  # Storage precision of indexed embeddings: float16 or float32
+app.config['DEBUG_SAVE_FACES'] = os.getenv("FACIAL_DEBUG_SAVE", "false").lower() == "true"  # Write every probe face crop to TEMP_DIR for debugging
+app.config['DEBUG_SAVE_MAX_FILES'] = int(os.getenv("FACIAL_DEBUG_SAVE_MAX", "200"))  # Debug crops kept in TEMP_DIR before the oldest are deleted
+app.config['LOAD_SAMPLES'] = os.getenv("LOAD_SAMPLES", "false").lower() == "true"  # Enroll the sample voters at startup (development only)
+app.config['ALIGN_FACES'] = os.getenv("ALIGN_FACES", "true").lower() == "true"  # Landmark-align crops before embedding
+app.config['PHASH_CACHE'] = os.getenv("PHASH_CACHE", "false").lower() == "true"  # Reuse embeddings of near-duplicate crops submitted for the same claimed identity
+app.config['PHASH_CACHE_SIZE'] = int(os.getenv("PHASH_CACHE_SIZE", "256"))  # Each lookup scans every entry
+app.config['PHASH_MAX_DISTANCE'] = int(os.getenv("PHASH_MAX_DISTANCE", "4"))  # Hamming distance (of 64 bits) still counted as the same frame
 
 # Groq API configuration
 app.config['GROQ_API_KEY'] = os.getenv("GROQ_API_KEY", "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")
@@ -121,6 +182,8 @@ app.config['FACE_API_KEY'] = os.getenv("FACE_API_KEY")
 app.config['FACE_API_SECRET'] = os.getenv("FACE_API_SECRET")
 app.config['FACE_API_URL'] = os.getenv("FACE_API_URL", "https://api-us.faceplusplus.com/facepp/v3/compare")
 app.config['FACEPLUSPLUS_CONFIDENCE_THRESHOLD'] = float(os.getenv("VERIFICATION_THRESHOLD", 75.0)) # Face++ uses 0-100 scale often
+app.config['FACEPP_LOCAL_MATCH'] = float(os.getenv("FACEPP_LOCAL_MATCH", "0.80"))  # Local cosine above this matches without calling Face++
+app.config['FACEPP_LOCAL_REJECT'] = float(os.getenv("FACEPP_LOCAL_REJECT", "0.35"))  # Local cosine below this rejects without calling Face++
 
 # Ensure directories exist
 os.makedirs(app.config['IMAGES_DIR'], exist_ok=True)
@@ -129,153 +192,468 @@ os.makedirs(app.config['MODEL_DIR'], exist_ok=True)
 
 # Global model variables
 face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+face_detector_pool = queue.LifoQueue() # Warmed YuNet detectors (preferred over the cascade), checked out per call since each keeps its own input size
+tf = None # TensorFlow, imported by import_tensorflow only when the Keras model is used
 face_model = None
+face_model_infer = None # Compiled forward pass of face_model
+face_session = None # ONNX Runtime session for the pretrained embedding model
+face_model_path = None # Model file face_session was created from
 reference_embedding = None # Global variable to store the reference embedding
 
-# Temporary database for development
-voter_database = {}  # Maps Aadhar+VoterID to face embeddings
+# ArcFace 112x112 canonical landmark positions: eye (image left), eye (image right),
+# nose tip, mouth corner (image left), mouth corner (image right)
+ARCFACE_TEMPLATE = np.array([
+    [38.2946, 51.6963],
+    [73.5318, 51.5014],
+    [56.0252, 71.7366],
+    [41.5493, 92.3655],
+    [70.7299, 92.2041],
+], dtype=np.float32)
+ALIGNED_FACE_SIZE = 112
+DETECTION_MAX_SIDE = int(os.getenv("DETECTION_MAX_SIDE", "320"))  # Images are downscaled to this longest side before face detection
+
+# Shared keep-alive session for outbound API calls, so requests skip the TCP and TLS handshake
+http_session = requests.Session()
+# Retry connection failures and gateway errors with a short backoff; POSTs are retried too
+http_retry = Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504], allowed_methods=None)
+http_session.mount('https://', HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=http_retry))
+
+# Shared pool for blocking image reads; cv2 releases the GIL while decoding.
+# Model inference stays on the calling thread.
+io_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
+
+class VoterDatabase:
+    """Voter records persisted in SQLite, shared by all workers and kept across restarts.
+
+    Supports the dict operations the routes use (`in`, `[]`, `get`, `keys`,
+    `items`, `len`); values are dicts with the masked Aadhar, voter ID,
+    registration time and image path. Each row also holds the voter's
+    unit-length embedding as a BLOB in GALLERY_DTYPE (float16 by default,
+    half the size of float32); get_embedding returns it as float32.
+    The database runs in WAL mode so readers never block on a registration.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()  # One connection per thread
+        with closing(sqlite3.connect(path)) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS voters
+                (voter_key TEXT PRIMARY KEY,
+                 aadhar_masked TEXT,
+                 voter_id TEXT,
+                 registration_time TEXT,
+                 image_path TEXT,
+                 embedding BLOB,
+                 embedding_model TEXT,
+                 embedding_dtype TEXT DEFAULT 'float32')
+            ''')
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(voters)')]
+            if 'embedding_dtype' not in columns:
+                # Databases created before float16 storage hold float32 embeddings
+                conn.execute("ALTER TABLE voters ADD COLUMN embedding_dtype TEXT DEFAULT 'float32'")
+            conn.execute('CREATE INDEX IF NOT EXISTS voters_voter_id ON voters(voter_id)')
+            conn.commit()
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def _record(row):
+        aadhar, voter_id, registration_time, image_path = row
+        return {
+            "aadhar": aadhar,
+            "voter_id": voter_id,
+            "registration_time": registration_time,
+            "image_path": image_path
+        }
+
+    def __contains__(self, voter_key):
+        return self.get(voter_key) is not None
+
+    def __getitem__(self, voter_key):
+        record = self.get(voter_key)
+        if record is None:
+            raise KeyError(voter_key)
+        return record
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM voters').fetchone()[0]
+
+    def get(self, voter_key, default=None):
+        row = self._connection().execute(
+            'SELECT aadhar_masked, voter_id, registration_time, image_path FROM voters WHERE voter_key = ?',
+            (voter_key,)).fetchone()
+        return default if row is None else self._record(row)
+
+    def keys(self):
+        return [row[0] for row in self._connection().execute('SELECT voter_key FROM voters')]
+
+    def items(self):
+        rows = self._connection().execute(
+            'SELECT voter_key, aadhar_masked, voter_id, registration_time, image_path FROM voters')
+        return [(row[0], self._record(row[1:])) for row in rows]
+
+    def find_by_voter_id(self, *voter_ids):
+        """Return (voter_key, record) for a voter with any of the given voter IDs, or None."""
+        row = self._connection().execute(
+            'SELECT voter_key, aadhar_masked, voter_id, registration_time, image_path FROM voters '
+            f'WHERE voter_id IN ({", ".join("?" * len(voter_ids))}) LIMIT 1', voter_ids).fetchone()
+        return None if row is None else (row[0], self._record(row[1:]))
+
+    def random_item(self):
+        """Return a random (voter_key, record), or None if there are no voters.
+
+        Seeks to a random rowid through the index instead of listing every key.
+        """
+        row = self._connection().execute(
+            'SELECT voter_key, aadhar_masked, voter_id, registration_time, image_path FROM voters '
+            'WHERE rowid >= (SELECT abs(random()) % max(rowid) + 1 FROM voters) ORDER BY rowid LIMIT 1').fetchone()
+        return None if row is None else (row[0], self._record(row[1:]))
+
+    def add(self, voter_key, record, embedding):
+        """Insert or replace a voter and their embedding."""
+        dtype = app.config['GALLERY_DTYPE']
+        conn = self._connection()
+        conn.execute('INSERT OR REPLACE INTO voters VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                     (voter_key, record["aadhar"], record["voter_id"], record["registration_time"],
+                      record["image_path"], l2_normalize(embedding).astype(dtype).tobytes(),
+                      get_embedding_model_id(), dtype))
+        conn.commit()
+
+    def update_embedding(self, voter_key, embedding):
+        """Replace a voter's embedding, e.g. after re-embedding with a new model."""
+        dtype = app.config['GALLERY_DTYPE']
+        conn = self._connection()
+        conn.execute('UPDATE voters SET embedding = ?, embedding_model = ?, embedding_dtype = ? WHERE voter_key = ?',
+                     (l2_normalize(embedding).astype(dtype).tobytes(), get_embedding_model_id(), dtype, voter_key))
+        conn.commit()
+
+    def get_embedding(self, voter_key):
+        """Return the voter's embedding, or None if there is none from the current model."""
+        row = self._connection().execute(
+            'SELECT embedding, embedding_model, embedding_dtype FROM voters WHERE voter_key = ?',
+            (voter_key,)).fetchone()
+        if row is None or row[1] != get_embedding_model_id():
+            return None
+        return np.frombuffer(row[0], dtype=row[2]).astype(np.float32, copy=False)
+
+    def get_with_embedding(self, voter_key):
+        """Return (record, embedding) in one query; either may be None as in get/get_embedding."""
+        row = self._connection().execute(
+            'SELECT aadhar_masked, voter_id, registration_time, image_path, '
+            'embedding, embedding_model, embedding_dtype FROM voters WHERE voter_key = ?',
+            (voter_key,)).fetchone()
+        if row is None:
+            return None, None
+        if row[5] != get_embedding_model_id():
+            return self._record(row[:4]), None
+        return self._record(row[:4]), np.frombuffer(row[4], dtype=row[6]).astype(np.float32, copy=False)
+
+voter_database = VoterDatabase(app.config['VOTER_DB_PATH'])
+
+# --- Database Connection ---
+DATABASE_URL = os.getenv('DATABASE_URL', 'voter_verification.db')
+db_connections = threading.local()
+
+def get_db_connection():
+    """Return this thread's connection to the SQLite database.
+
+    The connection stays open for the life of the thread, so callers must not
+    close it; sqlite3 also keeps its prepared statements cached across requests.
+    """
+    conn = getattr(db_connections, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE_URL)
+        conn.row_factory = sqlite3.Row # Return rows as dictionary-like objects
+        # WAL (set in init_db) makes NORMAL sync safe; mmap lets reads come straight from the page cache
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA mmap_size=268435456')
+        db_connections.conn = conn
+    return conn
 
 # Database initialization
 def init_db():
-    conn = sqlite3.connect('voter_verification.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS voter_verification
-        (aadhar_number TEXT PRIMARY KEY,
-         voter_id TEXT,
-         mobile_number TEXT,
-         face_encoding BLOB,
-         verification_time TIMESTAMP)
-    ''')
-    conn.commit()
-    conn.close()
+    with closing(sqlite3.connect(DATABASE_URL)) as conn:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS voter_verification
+            (aadhar_number TEXT PRIMARY KEY,
+             voter_id TEXT,
+             mobile_number TEXT,
+             face_encoding BLOB,
+             verification_time TIMESTAMP)
+        ''')
+        conn.commit()
 
 # Initialize database on startup
 init_db()
 
+FACE_ENCODING_DIM = 128  # Length of a face_recognition (dlib) encoding
+HOG_MAX_SIDE = 480  # Frames are downscaled to this longest side before dlib's HOG detector
+
 class FaceVerification:
-    def __init__(self):
-        self.known_face_encodings = {}
-        self.load_known_faces()
-
-    def load_known_faces(self):
-        conn = sqlite3.connect('voter_verification.db')
-        c = conn.cursor()
-        c.execute('SELECT aadhar_number, face_encoding FROM voter_verification')
-        for row in c.fetchall():
-            aadhar_number, face_encoding_blob = row
-            face_encoding = np.frombuffer(face_encoding_blob, dtype=np.float64)
-            self.known_face_encodings[aadhar_number] = face_encoding
-        conn.close()
-
-    def verify_face(self, image_data, aadhar_number):
+    """face_recognition verification against the encodings in voter_verification.db.
+
+    Encodings are looked up by Aadhar number per request instead of being
+    loaded into memory at startup, so startup cost does not grow with the
+    number of voters and a face registered through any worker is visible to
+    all of them.
+    """
+
+    def get_known_encoding(self, aadhar_number):
+        """Return the registered encoding for an Aadhar number, or None."""
+        row = get_db_connection().execute(
+            'SELECT face_encoding FROM voter_verification WHERE aadhar_number = ?', (aadhar_number,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        # float16 since register-face stopped writing float64; older rows are 8 bytes per value
+        dtype = np.float64 if len(row[0]) == FACE_ENCODING_DIM * 8 else np.float16
+        return np.frombuffer(row[0], dtype=dtype).astype(np.float64)
+
+    def verify_face(self, image_bytes, aadhar_number):
         try:
-            # Decode base64 image
-            image_bytes = base64.b64decode(image_data.split(',')[1])
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            # Convert to RGB (face_recognition uses RGB)
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            
-            # Find faces in the image
-            face_locations = face_recognition.face_locations(rgb_image)
-            if not face_locations:
+            face_encoding = get_face_recognition_encoding(image_bytes)
+            if face_encoding is None:
                 return {'isMatch': False, 'error': 'No face detected'}
 
-            # Get face encoding
-            face_encoding = face_recognition.face_encodings(rgb_image, face_locations)[0]
-
             # Check if we have a known face for this Aadhar number
-            if aadhar_number not in self.known_face_encodings:
+            known_encoding = self.get_known_encoding(aadhar_number)
+            if known_encoding is None:
                 return {'isMatch': False, 'error': 'No registered face found'}
 
-            # Compare faces
-            known_encoding = self.known_face_encodings[aadhar_number]
-            matches = face_recognition.compare_faces([known_encoding], face_encoding, tolerance=0.6)
-            face_distance = face_recognition.face_distance([known_encoding], face_encoding)[0]
+            # Compare faces: one Euclidean distance, the same test compare_faces applies
+            face_distance = float(np.linalg.norm(known_encoding - face_encoding))
             confidence = 1 - face_distance
 
             return {
-                'isMatch': matches[0],
+                'isMatch': face_distance <= 0.6,
                 'confidence': float(confidence),
-                'faceData': base64.b64encode(face_encoding.tobytes()).decode('utf-8')
+                'faceData': pybase64.b64encode(face_encoding.tobytes()).decode('utf-8')
             }
         except Exception as e:
             return {'isMatch': False, 'error': str(e)}
 
-face_verifier = FaceVerification()
-
-# --- Database Connection ---
-DATABASE_URL = os.getenv('DATABASE_URL', 'voter_verification.db')
+# Recent face_recognition encodings by image content, so client retries of the
+# same frame skip dlib's detector and encoder
+face_encoding_cache = LRUCache(maxsize=64)
+face_encoding_cache_lock = threading.Lock()
+
+def get_face_recognition_encoding(image_bytes):
+    """Return the 128-D face_recognition encoding of the first face in an encoded image, or None."""
+    key = blake3.blake3(image_bytes).digest()
+    with face_encoding_cache_lock:
+        if key in face_encoding_cache:
+            return face_encoding_cache[key]
+
+    # Decode straight to RGB (face_recognition uses RGB)
+    rgb_image = decode_image_bytes(image_bytes, rgb=True)
+    if rgb_image is None:
+        raise ValueError("Failed to decode image data")
+    # HOG cost grows with pixel count, so detect on a copy no larger than HOG_MAX_SIDE
+    # without upsampling, then encode from the full-resolution image
+    h, w = rgb_image.shape[:2]
+    scale = min(1.0, HOG_MAX_SIDE / max(h, w))
+    small = rgb_image if scale == 1.0 else cv2.resize(rgb_image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    face_locations = [tuple(int(v / scale) for v in location)
+                      for location in face_recognition.face_locations(small, number_of_times_to_upsample=0)]
+    face_encoding = None
+    if face_locations:
+        face_encoding = face_recognition.face_encodings(rgb_image, face_locations[:1])[0]
+        face_encoding.setflags(write=False)  # Shared between requests
+
+    with face_encoding_cache_lock:
+        face_encoding_cache[key] = face_encoding
+    return face_encoding
+
+def decode_base64_image(image_data):
+    """Decode a base64 image, with or without a data URL prefix."""
+    if image_data.startswith('data:'):
+        image_data = image_data[image_data.find(',') + 1:]
+    return pybase64.b64decode(image_data, validate=False)
 
-def get_db_connection():
-    """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect(DATABASE_URL)
-    conn.row_factory = sqlite3.Row # Return rows as dictionary-like objects
-    return conn
+face_verifier = FaceVerification()
 
-def load_metadata():
-    """Load the user metadata."""
-    if not os.path.exists(app.config['METADATA_FILE']):
-        with open(app.config['METADATA_FILE'], 'w') as f:
-            json.dump({}, f)
-    
-    with open(app.config['METADATA_FILE'], 'r') as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return {}
+metadata_store = MetadataStore(app.config['METADATA_DB'], app.config['METADATA_FILE'])
 
+@lru_cache(maxsize=4096)  # Bounded so arbitrary credentials can't grow it without limit
 def get_voter_key(aadhar, voter_id):
     """Create a unique key for a voter based on Aadhar and Voter ID."""
     # Hash the combination for privacy and consistent key generation
     key_string = f"{aadhar}:{voter_id}"
-    return hashlib.sha256(key_string.encode()).hexdigest()
-
-def save_metadata(metadata):
-    """Save the user metadata."""
-    with open(app.config['METADATA_FILE'], 'w') as f:
-        json.dump(metadata, f, indent=2)
+    return blake3.blake3(key_string.encode()).hexdigest()
 
 def register_voter(aadhar, voter_id, face_embedding, image_path=None):
-    """Register a voter in the temporary database."""
+    """Register a voter in the voter database."""
     voter_key = get_voter_key(aadhar, voter_id)
     
-    voter_database[voter_key] = {
+    voter_database.add(voter_key, {
         "aadhar": aadhar[:4] + "****" + aadhar[-4:],  # Mask for privacy
         "voter_id": voter_id,
-        "embedding": face_embedding.tolist() if hasattr(face_embedding, 'tolist') else face_embedding,
-        "registration_time": datetime.now().isoformat(),
+        "registration_time": now_iso(),
         "image_path": image_path
-    }
+    }, face_embedding)
     
     logger.info(f"Registered voter with key: {voter_key[:8]}...")
     return voter_key
 
+def use_onnx_model():
+    """Whether the pretrained ONNX embedding model is available."""
+    return ort is not None and os.path.exists(app.config['ONNX_MODEL_PATH'])
+
+def get_int8_model_path():
+    """Path of the INT8-quantized copy of the ONNX face model."""
+    root, ext = os.path.splitext(app.config['ONNX_MODEL_PATH'])
+    return f"{root}_int8{ext}"
+
+def get_onnx_model_path():
+    """The ONNX model to serve: the INT8 copy once it has been calibrated, otherwise the original."""
+    if app.config['FACE_MODEL_INT8'] and os.path.exists(get_int8_model_path()):
+        return get_int8_model_path()
+    return app.config['ONNX_MODEL_PATH']
+
+def onnx_input_blob(face_imgs):
+    """ArcFace-style input: RGB, NCHW, scaled to [-1, 1]."""
+    return cv2.dnn.blobFromImages(face_imgs, 1.0 / 127.5, (ALIGNED_FACE_SIZE, ALIGNED_FACE_SIZE),
+                                  (127.5, 127.5, 127.5), swapRB=True)
+
+def quantize_face_model():
+    """Write an INT8 (QDQ) copy of the ONNX face model, calibrated on the stored reference faces.
+
+    Returns False without writing anything when there are too few faces to calibrate on.
+    """
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    image_paths = metadata_store.image_paths()
+    if len(image_paths) < app.config['INT8_MIN_CALIBRATION_IMAGES']:
+        logger.info(f"Only {len(image_paths)} reference faces, not enough to calibrate an INT8 face model")
+        return False
+
+    input_name = ort.InferenceSession(app.config['ONNX_MODEL_PATH'], providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    class FaceCalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self.paths = iter(image_paths)
+
+        def get_next(self):
+            for path in self.paths:
+                face_img = read_image(path)
+                if face_img is None:
+                    continue
+                if app.config['ALIGN_FACES']:
+                    face_img = align_reference(face_img)
+                return {input_name: onnx_input_blob([face_img])}
+            return None
+
+    logger.info(f"Calibrating INT8 face model on {len(image_paths)} reference faces")
+    # Write under a temporary name so running servers never load a partial model
+    temp_path = f"{get_int8_model_path()}.{os.getpid()}.tmp"
+    quantize_static(app.config['ONNX_MODEL_PATH'], temp_path, FaceCalibrationReader(),
+                    quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QInt8, weight_type=QuantType.QInt8)
+    os.replace(temp_path, get_int8_model_path())
+    return True
+
+def prepare_face_model():
+    """Offline setup run before starting the server: calibrate the INT8 model and build engines.
+
+    Calibration and TensorRT engine builds can take minutes, longer than a
+    gunicorn worker may spend booting, so they are not done at worker startup.
+    Loading the model here also leaves its TensorRT engine in TRT_CACHE_DIR.
+    """
+    if not use_onnx_model():
+        logger.error(f"ONNX face model not found at {app.config['ONNX_MODEL_PATH']}")
+        return
+    if app.config['FACE_MODEL_INT8'] and not os.path.exists(get_int8_model_path()):
+        quantize_face_model()
+    init_face_model()
+
+def get_ort_providers(int8=False):
+    """Execution providers for the ONNX face model, fastest first.
+
+    TensorRT builds a fused FP16 (or INT8, for the quantized model) engine on
+    first use and caches it under TRT_CACHE_DIR; CUDA is next on GPU boxes.
+    On Intel hosts (onnxruntime-openvino) OpenVINO compiles the graph for the
+    VNNI CPU or the iGPU, per ORT_OPENVINO_DEVICE. Plain CPU is the fallback.
+    """
+    available = ort.get_available_providers()
+    providers = []
+    if app.config['ORT_TENSORRT'] and "TensorrtExecutionProvider" in available:
+        providers.append(("TensorrtExecutionProvider", {
+            "trt_fp16_enable": True,
+            "trt_int8_enable": int8,
+            "trt_engine_cache_enable": True,
+            "trt_engine_cache_path": app.config['TRT_CACHE_DIR'],
+        }))
+    if app.config['ORT_CUDA'] and "CUDAExecutionProvider" in available:
+        providers.append("CUDAExecutionProvider")
+    if app.config['ORT_OPENVINO_DEVICE'] and "OpenVINOExecutionProvider" in available:
+        providers.append(("OpenVINOExecutionProvider", {
+            "device_type": app.config['ORT_OPENVINO_DEVICE'],
+            "cache_dir": app.config['OPENVINO_CACHE_DIR'],
+        }))
+    providers.append("CPUExecutionProvider")
+    return providers
+
+def import_tensorflow():
+    """Import TensorFlow on first use.
+
+    The ONNX model, Groq and Face++ paths never touch it, so workers using
+    them skip TensorFlow's import time and resident memory.
+    """
+    global tf
+    if tf is None:
+        import tensorflow
+        # Allocate GPU memory as needed instead of reserving all of it for this process
+        for gpu in tensorflow.config.list_physical_devices('GPU'):
+            tensorflow.config.experimental.set_memory_growth(gpu, True)
+        tf = tensorflow
+    return tf
+
 def init_face_model():
     """Initialize or load the facial recognition model.
     Only needed when not using Groq API."""
-    global face_model
+    global face_model, face_session, face_model_path
     
     if app.config['USE_GROQ_API']:
         logger.info("Using Groq API for facial recognition, skipping local model initialization")
         return
+
+    if use_onnx_model():
+        # The INT8 copy is calibrated offline by prepare_face_model
+        model_path = get_onnx_model_path()
+        face_session = ort.InferenceSession(model_path, providers=get_ort_providers(int8=model_path != app.config['ONNX_MODEL_PATH']))
+        face_model_path = model_path
+        logger.info(f"Loaded ONNX face embedding model {model_path} ({', '.join(face_session.get_providers())})")
+        warm_up_face_model()
+        return
     
+    # Only the Keras model needs TensorFlow
+    import_tensorflow()
+    from tensorflow.keras.models import Sequential, load_model
+    from tensorflow.keras.layers import ZeroPadding2D, Convolution2D, MaxPooling2D, Dense, Dropout, Flatten
+
     model_path = os.path.join(app.config['MODEL_DIR'], "facenet_model.h5")
     
     # Check if we have a saved model
     if os.path.exists(model_path):
         logger.info(f"Loading existing facial recognition model from {model_path}")
         try:
-            face_model = load_model(model_path)
+            compile_face_model(load_model(model_path))
             return
         except Exception as e:
             logger.error(f"Error loading model: {str(e)}")
             logger.info("Creating new model instead")
     
     # Create a simplified CNN for facial embedding
-    logger.info("Initializing facial recognition model")
+    logger.warning(f"No pretrained face model found; set FACE_ONNX_MODEL or provide {app.config['ONNX_MODEL_PATH']}. "
+                   "Falling back to an untrained CNN whose embeddings are not meaningful")
     
     model = Sequential()
     
@@ -321,49 +699,283 @@ def init_face_model():
     
     # Save the model
     model.save(model_path)
+    compile_face_model(model)
+
+def mixed_precision_enabled():
+    """Whether the Keras model should compute in float16."""
+    setting = app.config['TF_MIXED_PRECISION']
+    if setting == "auto":
+        return bool(tf.config.list_physical_devices('GPU'))
+    return setting == "true"
+
+def apply_mixed_precision(model):
+    """Clone a float32 model under the mixed_float16 policy.
+
+    The final embedding layer stays float32 for numerical stability, so the
+    embeddings come out as float32.
+    """
+    last_layer = model.layers[-1]
+
+    def clone_layer(layer):
+        config = layer.get_config()
+        config['dtype'] = 'float32' if layer is last_layer else 'mixed_float16'
+        return layer.__class__.from_config(config)
+
+    clone = tf.keras.models.clone_model(model, clone_function=clone_layer)
+    clone.set_weights(model.get_weights())
+    return clone
+
+def compile_face_model(model):
+    """Install the Keras model and its compiled inference function."""
+    global face_model, face_model_infer
+
+    if mixed_precision_enabled():
+        logger.info("Using mixed_float16 precision for the face model")
+        model = apply_mixed_precision(model)
+
     face_model = model
+    # Takes the raw uint8 batch; the cast and 1/255 scale fuse into the first convolution.
+    # The fixed signature means one trace for every batch size.
+    face_model_infer = tf.function(lambda batch: model(tf.cast(batch, tf.float32) * (1.0 / 255.0), training=False),
+                                   input_signature=[tf.TensorSpec([None, 96, 96, 3], tf.uint8)],
+                                   jit_compile=app.config['TF_XLA'])
+    warm_up_face_model()
+
+def warm_up_face_model():
+    """Run a dummy face through the model so tracing and compilation happen before the first request."""
+    start_time = time.time()
+    get_face_embeddings([np.zeros((ALIGNED_FACE_SIZE, ALIGNED_FACE_SIZE, 3), dtype=np.uint8)])
+    logger.info(f"Face model warm-up took {time.time() - start_time:.2f}s")
 
-def preprocess_face(face_img):
-    """Preprocess a face image for the model."""
-    # Resize to expected dimensions
-    face_img = cv2.resize(face_img, (96, 96))
-    
+def align_face(face_img):
+    """Warp a face crop onto the canonical ArcFace template.
+
+    Uses dlib's 5-point landmark model (eye corners and nose tip) through
+    face_recognition; the eye centers and nose tip are mapped to the template
+    with a similarity transform. Returns the crop unchanged if no landmarks are found.
+    """
+    if len(face_img.shape) == 3:
+        gray = cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = face_img
+    h, w = gray.shape[:2]
+
+    # The crop is the detection box, so pass its full extent as the face location
+    landmarks = face_recognition.face_landmarks(gray, [(0, w, h, 0)], model='small')
+    if not landmarks:
+        return face_img
+
+    points = landmarks[0]
+    src = np.array([
+        # face_recognition's 'left_eye' (dlib points 2-3) is the eye on the image left,
+        # matching ARCFACE_TEMPLATE[0]; 'right_eye' (points 0-1) is on the image right
+        np.mean(points['left_eye'], axis=0),
+        np.mean(points['right_eye'], axis=0),
+        points['nose_tip'][0],
+    ], dtype=np.float32)
+
+    aligned = warp_to_template(face_img, src, ARCFACE_TEMPLATE[:3])
+    return face_img if aligned is None else aligned
+
+def face_input_size():
+    """Side length of the face crops the embedding model consumes."""
+    if app.config['USE_GROQ_API'] or use_onnx_model():
+        return ALIGNED_FACE_SIZE
+    return 96  # Keras CNN input
+
+def warp_to_template(img, points, template):
+    """Similarity-warp img so that points land on template. Returns None if no transform is found.
+
+    The template is given at ALIGNED_FACE_SIZE and scaled to the model input
+    size, so the aligned crop needs no further resize before inference.
+    """
+    size = face_input_size()
+    template = template * (size / ALIGNED_FACE_SIZE)
+    matrix, _ = cv2.estimateAffinePartial2D(np.asarray(points, dtype=np.float32), template, method=cv2.LMEDS)
+    if matrix is None:
+        return None
+    return cv2.warpAffine(img, matrix, (size, size), borderMode=cv2.BORDER_REPLICATE)
+
+# Per-thread input buffers reused across calls instead of allocating a batch per request
+preprocess_buffers = threading.local()
+
+def get_preprocess_buffer(batch_size):
+    """Return this thread's (batch_size, 96, 96, 3) uint8 input buffer, growing it when needed."""
+    buf = getattr(preprocess_buffers, 'batch', None)
+    if buf is None or buf.shape[0] < batch_size:
+        buf = np.empty((batch_size, 96, 96, 3), dtype=np.uint8)
+        preprocess_buffers.batch = buf
+    return buf[:batch_size]
+
+def preprocess_face(face_img, out=None):
+    """Resize a face image to the model input, writing into out when given.
+
+    Pixels stay uint8; scaling to [0, 1] is part of the compiled model.
+    """
     # Convert to RGB if grayscale
-    if len(face_img.shape) == 2:
-        face_img = cv2.cvtColor(face_img, cv2.COLOR_GRAY2RGB)
-    elif face_img.shape[2] == 1:
+    if face_img.ndim == 2 or face_img.shape[2] == 1:
         face_img = cv2.cvtColor(face_img, cv2.COLOR_GRAY2RGB)
     
-    # Normalize pixel values
-    face_img = face_img.astype(np.float32) / 255.0
-    
-    return face_img
+    # Aligned crops are already warped to the input size; only unaligned crops need resizing
+    if face_img.shape[:2] == (96, 96):
+        if out is None:
+            return face_img
+        np.copyto(out, face_img)
+        return out
+    return cv2.resize(face_img, (96, 96), dst=out)
+
+class EmbeddingBatcher:
+    """Coalesce concurrent single-face embedding requests into batched model calls.
+
+    Request threads submit faces and block on a Future; one daemon thread
+    drains up to max_batch faces, waiting at most timeout_ms after the first
+    one, and runs them through get_face_embeddings together.
+    """
+
+    def __init__(self, max_batch, timeout_ms):
+        self.max_batch = max_batch
+        self.timeout = timeout_ms / 1000.0
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, face_img):
+        """Queue a face and return a Future for its embedding."""
+        future = Future()
+        with self.lock:
+            # Started lazily so forked workers each get their own thread
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self.thread.start()
+        self.queue.put((face_img, future))
+        return future
+
+    def _run(self):
+        while True:
+            items = [self.queue.get()]
+            deadline = time.monotonic() + self.timeout
+            while len(items) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                embeddings = get_face_embeddings([face_img for face_img, _ in items])
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, future), embedding in zip(items, embeddings):
+                future.set_result(embedding)
+
+embedding_batcher = EmbeddingBatcher(app.config['EMBED_BATCH_MAX'], app.config['EMBED_BATCH_TIMEOUT_MS'])
+
+# Content-addressed cache of recent embeddings, so retried or duplicate uploads skip the model
+embedding_cache = LRUCache(maxsize=4096)
+embedding_cache_lock = threading.Lock()
+embedding_cache_stats = {"hits": 0, "misses": 0, "phash_hits": 0}
+
+# Near-duplicate layer behind embedding_cache: (claimed identity, pHash of the crop) ->
+# (model id, embedding), so frames a client re-sends for the same voter or user
+# after re-encoding or a slight shift also skip the model. Faces of different
+# people can have close pHashes, so entries are never shared across identities.
+phash_cache = LRUCache(maxsize=app.config['PHASH_CACHE_SIZE'])
+
+def perceptual_hash(face_img):
+    """64-bit DCT perceptual hash (pHash) of a face crop."""
+    gray = face_img if face_img.ndim == 2 else cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    bits = np.packbits((low > np.median(low)).ravel())
+    return int.from_bytes(bits.tobytes(), "big")
+
+def find_near_duplicate(identity, phash, model_id):
+    """Embedding of a crop cached for identity within PHASH_MAX_DISTANCE bits of phash.
+
+    Call with embedding_cache_lock held.
+    """
+    max_distance = app.config['PHASH_MAX_DISTANCE']
+    for key, (key_model_id, embedding) in phash_cache.items():
+        if key[0] == identity and key_model_id == model_id and bin(key[1] ^ phash).count("1") <= max_distance:
+            phash_cache[key]  # Mark as recently used
+            return embedding
+    return None
+
+def get_face_embedding(face_img, identity=None):
+    """Get the embedding vector for a face using local model or Groq API.
+
+    identity is the voter key or user ID the face is claimed to belong to.
+    Only then, and with PHASH_CACHE on, may a near-duplicate crop submitted
+    for the same identity supply the embedding.
+    """
+    model_id = get_embedding_model_id()
+    hasher = blake3.blake3(np.ascontiguousarray(face_img))
+    hasher.update(str(face_img.shape).encode())
+    hasher.update(b"\0")
+    hasher.update(model_id.encode())
+    key = hasher.digest()
+    phash = perceptual_hash(face_img) if app.config['PHASH_CACHE'] and identity is not None else None
+    with embedding_cache_lock:
+        embedding = embedding_cache.get(key)
+        if embedding is not None:
+            embedding_cache_stats["hits"] += 1
+            return embedding
+        if phash is not None:
+            embedding = find_near_duplicate(identity, phash, model_id)
+            if embedding is not None:
+                # Not stored under this crop's exact key, which any identity could hit
+                embedding_cache_stats["phash_hits"] += 1
+                return embedding
+        embedding_cache_stats["misses"] += 1
 
-def get_face_embedding(face_img):
-    """Get the embedding vector for a face using local model or Groq API."""
     if app.config['USE_GROQ_API']:
-        return get_groq_embedding(face_img)
+        embedding = l2_normalize(get_groq_embedding(face_img))
     else:
-        if face_model is None:
-            init_face_model()
-        
-        # Preprocess the face
-        processed_face = preprocess_face(face_img)
-        
-        # Expand dimensions to create a batch of size 1
-        batch = np.expand_dims(processed_face, axis=0)
-        
-        # Get the embedding
-        embedding = face_model.predict(batch, verbose=0)[0]
-        
-        return embedding
+        embedding = embedding_batcher.submit(face_img).result()
+    embedding.setflags(write=False)  # Shared between callers
+    with embedding_cache_lock:
+        embedding_cache[key] = embedding
+        if phash is not None:
+            phash_cache[(identity, phash)] = (model_id, embedding)
+    return embedding
+
+def get_face_embeddings(face_imgs):
+    """Get unit-length embedding vectors for several faces, batching them through the local model."""
+    if app.config['USE_GROQ_API']:
+        return l2_normalize(np.stack([get_groq_embedding(face_img) for face_img in face_imgs]))
+
+    if face_model is None and face_session is None:
+        init_face_model()
+
+    if face_session is not None:
+        batch = onnx_input_blob(face_imgs)
+        embeddings = face_session.run(None, {face_session.get_inputs()[0].name: batch})[0]
+        return l2_normalize(embeddings)
+
+    # Preprocess the faces into a single (N, 96, 96, 3) batch, padded to a power
+    # of two so XLA only compiles the forward pass for a few batch shapes
+    count = len(face_imgs)
+    batch = get_preprocess_buffer(1 << (count - 1).bit_length())
+    for face_img, out in zip(face_imgs, batch):
+        preprocess_face(face_img, out=out)
+
+    # Get the embeddings in one compiled forward pass
+    return l2_normalize(face_model_infer(tf.constant(batch)).numpy()[:count])
 
 def get_groq_embedding(face_img):
     """Get face embedding using Groq API."""
     try:
-        # Convert image to base64
-        _, buffer = cv2.imencode('.jpg', face_img)
-        img_str = base64.b64encode(buffer).decode('utf-8')
+        # Shrink the crop to the model input size before encoding; payload size scales with pixels
+        if face_img.shape[:2] != (ALIGNED_FACE_SIZE, ALIGNED_FACE_SIZE):
+            face_img = cv2.resize(face_img, (ALIGNED_FACE_SIZE, ALIGNED_FACE_SIZE), interpolation=cv2.INTER_AREA)
+
+        # Convert image to base64 (quality 75 cuts the payload ~3x)
+        _, buffer = cv2.imencode('.jpg', face_img, [cv2.IMWRITE_JPEG_QUALITY, 75])
+        img_str = pybase64.b64encode(buffer).decode('utf-8')
         
         # Prepare request to Groq API
         headers = {
@@ -400,19 +1012,19 @@ def get_groq_embedding(face_img):
         }
         
         # Make request to Groq API
-        response = requests.post(app.config['GROQ_API_URL'], headers=headers, json=data)
+        response = http_session.post(app.config['GROQ_API_URL'], headers=headers, json=data, timeout=(3, 30))
         
         if response.status_code != 200:
             logger.error(f"Groq API error: {response.status_code}, {response.text}")
             raise Exception(f"Groq API returned status code {response.status_code}")
         
         # Extract the embedding from the response
-        result = response.json()
+        result = orjson.loads(response.content)
         content = result.get("choices", [{}])[0].get("message", {}).get("content", "{}")
         
         try:
             # Parse the content which should be a JSON string containing the embedding
-            embedding_data = json.loads(content)
+            embedding_data = orjson.loads(content)
             embedding = embedding_data.get("embedding", [])
             
             # If embedding is empty or not a list, synthesize one using the local model
@@ -425,28 +1037,15 @@ def get_groq_embedding(face_img):
                 embedding.append(0.0)
                 
             return np.array(embedding)
-        except (json.JSONDecodeError, ValueError) as e:
+        except ValueError as e:  # Includes orjson.JSONDecodeError
             logger.error(f"Error parsing Groq API response: {str(e)} - {content}")
             raise Exception(f"Failed to extract embedding from Groq API response: {str(e)}")
     
     except Exception as e:
+        # No local fallback: Groq mode never loads a local model, and a made-up
+        # embedding would let verification pass or fail at random
         logger.error(f"Error getting Groq embedding: {str(e)}")
-        # Fallback to local model if Groq API fails
-        if face_model is None:
-            init_face_model()
-            
-        if face_model is None:
-            # If we still don't have a model, generate a random embedding
-            # This is just for development purposes when neither API nor model works
-            logger.warning("Using random embedding as fallback (development only)")
-            random_embedding = np.random.randn(128)
-            return random_embedding / np.linalg.norm(random_embedding)
-        
-        processed_face = preprocess_face(face_img)
-        batch = np.expand_dims(processed_face, axis=0)
-        embedding = face_model.predict(batch, verbose=0)[0]
-        
-        return embedding
+        raise
 
 def load_reference_embedding():
     """Load the embedding for the single reference image used in voting."""
@@ -456,23 +1055,24 @@ def load_reference_embedding():
         reference_embedding = None
         return
 
+    # Embeddings are cached per image content and model, so restarts skip detection and inference
+    with open(app.config['REFERENCE_IMAGE_PATH'], 'rb') as f:
+        digest = blake3.blake3(f.read() + get_embedding_model_id().encode()).hexdigest()
+    cache_path = os.path.join(app.config['MODEL_DIR'], f"ref_{digest[:32]}.npy")
+    if os.path.exists(cache_path):
+        reference_embedding = np.load(cache_path)
+        logger.info(f"Loaded cached reference embedding from {cache_path}")
+        return
+
     logger.info(f"Loading reference image from {app.config['REFERENCE_IMAGE_PATH']}")
-    ref_img = cv2.imread(app.config['REFERENCE_IMAGE_PATH'])
+    ref_img = read_image(app.config['REFERENCE_IMAGE_PATH'])
     if ref_img is None:
         logger.error(f"CRITICAL: Failed to load reference image: {app.config['REFERENCE_IMAGE_PATH']}")
         reference_embedding = None
         return
 
-    # Encode the image to bytes to pass to extract_face_from_image
-    is_success, buffer = cv2.imencode(".png", ref_img)
-    if not is_success:
-        logger.error("Failed to encode reference image to PNG format.")
-        reference_embedding = None
-        return
-    image_data_bytes = buffer.tobytes()
-
     # Extract face from reference image (best practice, though might be pre-cropped)
-    ref_face, error = extract_face_from_image(base64.b64encode(image_data_bytes).decode('utf-8')) # Needs base64 string
+    ref_face, error = extract_face_from_bgr(ref_img)
     if error:
         # Fallback: try using the whole image if face extraction fails on reference
         logger.warning(f"Could not extract face from reference image ({error}), attempting to use whole image.")
@@ -482,6 +1082,9 @@ def load_reference_embedding():
         try:
             reference_embedding = get_face_embedding(ref_face)
             if reference_embedding is not None:
+                 # Store unit length so comparisons are a plain dot product
+                 reference_embedding = l2_normalize(reference_embedding)
+                 np.save(cache_path, reference_embedding)
                  logger.info("Reference embedding loaded successfully.")
             else:
                  logger.error("Failed to generate embedding for the reference face.")
@@ -502,135 +1105,566 @@ def load_sample_data():
         {"aadhar": "987654321098", "voter_id": "XYZ7654321", "image_path": "images/users/WIN_20250408_19_12_02_Pro.jpg"},
     ]
     
-    # Register each sample voter
-    sample_count = 0
-    for voter in sample_voters:
-        # Check if image exists
-        if not os.path.exists(voter["image_path"]):
-            logger.warning(f"Sample image not found: {voter['image_path']}")
-            continue
-            
-        try:
-            # Read and process image
-            img = cv2.imread(voter["image_path"])
-            if img is None:
-                logger.warning(f"Could not read image: {voter['image_path']}")
-                continue
-                
-            # Get face from image
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            faces = face_cascade.detectMultiScale(gray, 1.3, 5)
-            
-            if len(faces) == 0:
-                logger.warning(f"No face detected in sample image: {voter['image_path']}")
-                continue
-                
-            # Extract largest face
-            faces = sorted(faces, key=lambda x: x[2] * x[3], reverse=True)
-            x, y, w, h = faces[0]
-            face_img = img[y:y+h, x:x+w]
+    # Read and detect every sample in parallel, then embed the faces in one batch
+    results = list(io_executor.map(load_sample_face, sample_voters))
+    loaded = [(voter, face_img) for voter, face_img in zip(sample_voters, results) if face_img is not None]
+    if not loaded:
+        logger.info("Loaded 0 sample voters for development")
+        return
+
+    try:
+        embeddings = get_face_embeddings([face_img for _, face_img in loaded])
+    except Exception as e:
+        logger.error(f"Error processing sample voters: {str(e)}")
+        return
+
+    # Register serially on this thread
+    for (voter, _), embedding in zip(loaded, embeddings):
+        register_voter(voter["aadhar"], voter["voter_id"], embedding, voter["image_path"])
+    
+    logger.info(f"Loaded {len(loaded)} sample voters for development")
+
+def load_sample_face(voter):
+    """Read a sample voter's image and crop the largest face, or return None."""
+    # Check if image exists
+    if not os.path.exists(voter["image_path"]):
+        logger.warning(f"Sample image not found: {voter['image_path']}")
+        return None
+        
+    try:
+        # Read and process image
+        img = read_image(voter["image_path"])
+        if img is None:
+            logger.warning(f"Could not read image: {voter['image_path']}")
+            return None
             
-            # Get embedding and register voter
-            embedding = get_face_embedding(face_img)
-            register_voter(voter["aadhar"], voter["voter_id"], embedding, voter["image_path"])
-            sample_count += 1
+        # Get face from image
+        faces = detect_faces(img)
+        
+        if len(faces) == 0:
+            logger.warning(f"No face detected in sample image: {voter['image_path']}")
+            return None
             
+        # Extract largest face
+        return crop_face(img, *faces[0])
+        
+    except Exception as e:
+        logger.error(f"Error processing sample voter: {str(e)}")
+        return None
+
+
+def compute_similarity(embedding, references):
+    """Compute the cosine similarity between an embedding and one or more references.
+
+    Both sides must already be unit length, as returned by get_face_embedding,
+    so this is a single dot product. `references` may be a single embedding or
+    an (N, D) matrix, in which case all N similarities come from one
+    matrix-vector product.
+    """
+    return references @ embedding
+
+def _dot_rows(query, refs, out):
+    """Write the dot product of query with each row of refs into out."""
+    for i in range(refs.shape[0]):
+        total = 0.0
+        for j in range(refs.shape[1]):
+            total += query[j] * refs[i, j]
+        out[i] = total
+
+# A compiled loop beats BLAS call overhead for the handful of references one user has
+dot_rows = njit(fastmath=True, cache=True)(_dot_rows) if njit is not None else None
+SMALL_KERNEL_MAX_ROWS = 256
+
+def l2_normalize(embeddings):
+    """Scale embeddings to unit length along the last axis."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+class ReferenceIndex:
+    """Inner-product index over L2-normalized reference embeddings.
+
+    Each row is labelled with the owning user_id, image path and image row id,
+    so a search only scores the requesting user's references. Uses FAISS when
+    installed and a plain NumPy matrix otherwise.
+    """
+
+    def __init__(self):
+        self.dim = None
+        self.labels = []  # row -> [user_id, image_path, image_id], None once retired
+        self.user_rows = {}
+        self.image_ids = set()
+        self.index = None
+        self.user_refs = None  # NumPy backend: user_id -> (N, D) matrix
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def contains(self, image_id):
+        return image_id in self.image_ids
+
+    @property
+    def storage_dtype(self):
+        return np.float16 if app.config['GALLERY_DTYPE'] == "float16" else np.float32
+
+    def _create_index(self, dim):
+        self.dim = dim
+        # Verification is 1:1, so only flat storage is needed: an approximate (HNSW)
+        # index would add graph upkeep without ever being searched as a whole
+        if faiss is None:
+            self.user_refs = {}
+        elif self.storage_dtype == np.float16:
+            self.index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+        else:
+            self.index = faiss.IndexFlatIP(dim)
+
+    def _add_labels(self, user_id, images):
+        for image_id, image_path in images:
+            self.user_rows.setdefault(user_id, []).append(len(self.labels))
+            self.labels.append([user_id, image_path, image_id])
+            self.image_ids.add(image_id)
+
+    def add(self, user_id, images, embeddings):
+        """Add reference embeddings for a user; images are (image id, image path) pairs."""
+        embeddings = np.ascontiguousarray(l2_normalize(np.vstack(embeddings)))
+        with self.lock:
+            if self.dim is None:
+                self._create_index(embeddings.shape[1])
+            if self.index is not None:
+                self.index.add(embeddings)
+                self._add_labels(user_id, images)
+                return
+
+            embeddings = embeddings.astype(self.storage_dtype)
+            if user_id in self.user_refs:
+                self.user_refs[user_id] = np.vstack([self.user_refs[user_id], embeddings])
+            else:
+                self.user_refs[user_id] = embeddings
+            self._add_labels(user_id, images)
+
+    def retire(self, user_id, image_ids):
+        """Stop scoring the user's rows whose image id is not in image_ids.
+
+        A reference replaced in the metadata store gets a new row id, so its old
+        vector is retired here. FAISS keeps the dead row but it is never scored.
+        Returns True if any row was retired.
+        """
+        with self.lock:
+            rows = self.user_rows.get(user_id, [])
+            keep = [self.labels[row][2] in image_ids for row in rows]
+            if all(keep):
+                return False
+            for row, kept in zip(rows, keep):
+                if not kept:
+                    self.image_ids.discard(self.labels[row][2])
+                    self.labels[row] = None
+            self.user_rows[user_id] = [row for row, kept in zip(rows, keep) if kept]
+            if self.user_refs is not None:
+                self.user_refs[user_id] = self.user_refs[user_id][np.asarray(keep)]
+            return True
+
+    def search(self, user_id, query, k=5):
+        """Return up to k (similarity, image_path) pairs for the user's references, best first.
+
+        Holds the lock like add(): FAISS indexes do not support searching while
+        another thread adds to them.
+        """
+        query = np.ascontiguousarray(l2_normalize(query).reshape(1, -1))
+        with self.lock:
+            return self._search(user_id, query, k)
+
+    def _search(self, user_id, query, k):
+        rows = self.user_rows.get(user_id)
+        if not rows:
+            return []
+        if self.index is not None:
+            # Score only the user's own rows: a filtered search over the whole
+            # gallery costs O(gallery) and can miss rows on approximate indexes
+            refs = self.index.reconstruct_batch(np.asarray(rows, dtype=np.int64))
+        else:
+            # NumPy has no BLAS path for float16, so upcast the (small) per-user block
+            refs = self.user_refs[user_id].astype(np.float32, copy=False)
+        if dot_rows is not None and len(refs) < SMALL_KERNEL_MAX_ROWS:
+            similarities = np.empty(len(refs), dtype=np.float32)
+            dot_rows(query[0], np.ascontiguousarray(refs), similarities)
+        else:
+            similarities = refs @ query[0]
+        order = np.argsort(-similarities)[:k]
+        return [(float(similarities[i]), self.labels[rows[i]][1]) for i in order]
+
+    def save(self):
+        """Persist the index and its labels so restarts skip re-embedding.
+
+        Each file is written to a temporary name and renamed into place, so a
+        worker loading the index never sees a partly written file. The labels
+        go last; load() rejects a data file whose row count does not match them.
+        """
+        base_path = app.config['REFERENCE_INDEX_PATH']
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with self.lock:
+            if self.dim is None:
+                return
+            if self.index is not None:
+                faiss.write_index(self.index, base_path + ".faiss" + suffix)
+                os.replace(base_path + ".faiss" + suffix, base_path + ".faiss")
+            else:
+                matrix = np.zeros((len(self.labels), self.dim), dtype=self.storage_dtype)
+                for user_id, rows in self.user_rows.items():
+                    matrix[rows] = self.user_refs[user_id]
+                with open(base_path + ".npy" + suffix, 'wb') as f:
+                    np.save(f, matrix)
+                os.replace(base_path + ".npy" + suffix, base_path + ".npy")
+            with open(base_path + ".json" + suffix, 'wb') as f:
+                f.write(orjson.dumps({"dim": self.dim, "model": get_embedding_model_id(), "labels": self.labels}))
+            os.replace(base_path + ".json" + suffix, base_path + ".json")
+
+    def load(self, known_ids):
+        """Load a persisted index. Returns False if it is missing or stale.
+
+        known_ids is the set of reference image row ids in the metadata store.
+        """
+        base_path = app.config['REFERENCE_INDEX_PATH']
+        data_path = base_path + (".faiss" if faiss is not None else ".npy")
+        if not os.path.exists(base_path + ".json") or not os.path.exists(data_path):
+            return False
+
+        try:
+            with open(base_path + ".json", 'rb') as f:
+                saved = orjson.loads(f.read())
+            if saved.get("model") != get_embedding_model_id():
+                logger.info("Persisted reference index was built with another model, rebuilding")
+                return False
+            labels = saved["labels"]
+            if any(label is not None and (len(label) != 3 or label[2] not in known_ids) for label in labels):
+                logger.info("Persisted reference index is stale, rebuilding")
+                return False
+            if faiss is not None:
+                index = faiss.read_index(data_path)
+                rows = index.ntotal
+            else:
+                matrix = np.load(data_path).astype(self.storage_dtype, copy=False)
+                rows = len(matrix)
         except Exception as e:
-            logger.error(f"Error processing sample voter: {str(e)}")
-    
-    logger.info(f"Loaded {sample_count} sample voters for development")
+            logger.warning(f"Could not read persisted reference index, rebuilding: {str(e)}")
+            return False
+        if rows != len(labels):
+            logger.info("Persisted reference index does not match its labels, rebuilding")
+            return False
+
+        with self.lock:
+            self.dim = saved["dim"]
+            for label in labels:
+                if label is None:
+                    self.labels.append(None)  # Retired row, kept so row numbers line up
+                else:
+                    user_id, image_path, image_id = label
+                    self._add_labels(user_id, [(image_id, image_path)])
+            if faiss is not None:
+                self.index = index
+            else:
+                self.user_refs = {user_id: np.ascontiguousarray(matrix[user_rows])
+                                  for user_id, user_rows in self.user_rows.items()}
+        return True
 
+reference_index = ReferenceIndex()
 
-def compute_similarity(embedding1, embedding2):
-    """Compute the cosine similarity between two embeddings."""
-    embedding1_array = np.array(embedding1)
-    embedding2_array = np.array(embedding2)
-    
-    dot_product = np.dot(embedding1_array, embedding2_array)
-    norm1 = np.linalg.norm(embedding1_array)
-    norm2 = np.linalg.norm(embedding2_array)
-    similarity = dot_product / (norm1 * norm2)
-    
-    return similarity
+def get_embedding_model_id():
+    """Identify the embedding model so cached embeddings from another model are ignored."""
+    if app.config['USE_GROQ_API']:
+        return "groq"
+    # The model this worker actually loaded: another process may have added the INT8 copy since
+    model_id = os.path.basename(face_model_path or get_onnx_model_path()) if use_onnx_model() else "facenet_model.h5"
+    if app.config['ALIGN_FACES']:
+        # v2: references are aligned with the detector's landmarks, like probes
+        return model_id + "+aligned-v2"
+    return model_id
+
+def encode_embedding(embedding):
+    """Serialize an embedding as float32 bytes for the metadata store."""
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+def decode_embedding(data):
+    """Deserialize an embedding written by encode_embedding."""
+    return np.frombuffer(data, dtype=np.float32)
+
+def index_user_references(user_id, images):
+    """Index any of the user's reference images that are not indexed yet.
+
+    images are reference dicts from the metadata store. Embeddings cached there
+    are reused; missing ones are computed and written back to the store.
+    Rows for images that were since replaced are retired from the index.
+    Returns True if the index changed, so the caller can save it.
+    """
+    model_id = get_embedding_model_id()
+    retired = reference_index.retire(user_id, {image_info["id"] for image_info in images})
+    indexed = []  # (image id, image path) pairs
+    embeddings = []
+    pending = []
+    for image_info in images:
+        image_path = image_info["path"]
+        if reference_index.contains(image_info["id"]):
+            continue
+
+        if image_info.get("embedding") and image_info.get("embedding_model") == model_id:
+            indexed.append((image_info["id"], image_path))
+            embeddings.append(decode_embedding(image_info["embedding"]))
+            continue
+
+        if not os.path.exists(image_path):
+            logger.warning(f"Reference image not found: {image_path}")
+            continue
+
+        pending.append(image_info)
+
+    # Decode the uncached references in parallel
+    ref_imgs = io_executor.map(read_image, [image_info["path"] for image_info in pending])
+    loaded = []
+    for image_info, ref_img in zip(pending, ref_imgs):
+        if ref_img is None:
+            logger.warning(f"Failed to load reference image: {image_info['path']}")
+            continue
+        if app.config['ALIGN_FACES']:
+            # Stored references are unaligned face crops
+            ref_img = align_reference(ref_img)
+        loaded.append((image_info, ref_img))
+    pending = loaded
+
+    if pending:
+        # Embed all uncached references in a single batch
+        new_embeddings = get_face_embeddings([ref_img for _, ref_img in pending])
+        metadata_store.set_embeddings([(image_info["id"], encode_embedding(embedding), model_id)
+                                       for (image_info, _), embedding in zip(pending, new_embeddings)])
+        indexed.extend((image_info["id"], image_info["path"]) for image_info, _ in pending)
+        embeddings.extend(new_embeddings)
+
+    if indexed:
+        reference_index.add(user_id, indexed, embeddings)
+    return retired or bool(indexed)
+
+def build_reference_index():
+    """Load the persisted reference index and index any references it is missing.
+
+    Also acts as the one-shot migration for metadata written before embeddings
+    were cached: every reference without a cached embedding is embedded and saved.
+    """
+    reference_index.load(set(metadata_store.image_ids()))
+
+    updated = False
+    for user_id, references in metadata_store.references_by_user().items():
+        updated |= index_user_references(user_id, references)
+    # Save once for the whole build rather than once per user
+    if updated:
+        reference_index.save()
+
+    backend = "FAISS" if faiss is not None else "NumPy"
+    logger.info(f"Reference index ready with {len(reference_index)} embeddings ({backend})")
+
+# OpenCV 4.10+ can decode straight to RGB, skipping the cvtColor pass over the image
+IMREAD_COLOR_RGB = getattr(cv2, 'IMREAD_COLOR_RGB', None)
+
+def decode_image_bytes(image_bytes, rgb=False):
+    """Decode encoded image bytes to a BGR (or RGB) array, using libjpeg-turbo when available."""
+    # Only JPEGs (SOI marker FF D8) go to libjpeg-turbo; PNG and others skip straight to OpenCV
+    if turbo_jpeg is not None and image_bytes[:2] == b"\xff\xd8":
+        try:
+            # Large photos are decoded at 1/2, 1/4 or 1/8 scale inside the IDCT, which is
+            # far cheaper than decoding every pixel and downscaling for detection later
+            width, height = turbo_jpeg.decode_header(image_bytes)[:2]
+            denominator = 1
+            while denominator < 8 and max(width, height) // (denominator * 2) >= app.config['MAX_DECODE_SIDE']:
+                denominator *= 2
+            # libjpeg-turbo writes either channel order directly, so RGB costs no extra pass.
+            # The fast integer IDCT is well within what detection and embedding can tell apart.
+            return turbo_jpeg.decode(image_bytes, pixel_format=TJPF_RGB if rgb else TJPF_BGR,
+                                     scaling_factor=(1, denominator), flags=TJFLAG_FASTDCT)
+        except Exception:
+            pass  # Corrupt or unsupported JPEG; let OpenCV try
+    if rgb and IMREAD_COLOR_RGB is not None:
+        return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), IMREAD_COLOR_RGB)
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if rgb and image is not None:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return image
+
+def write_jpeg(path, img, quality=85):
+    """Encode a BGR image as JPEG, with libjpeg-turbo when available, and write it to path."""
+    if turbo_jpeg is not None:
+        data = turbo_jpeg.encode(np.ascontiguousarray(img), quality=quality)
+    else:
+        ok, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            raise ValueError(f"Failed to encode image for {path}")
+        data = buffer.tobytes()
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def read_image(path):
+    """Read an image file like cv2.imread, decoding straight from a memory map of the file."""
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return decode_image_bytes(mapped)
+    except (OSError, ValueError):  # Missing, unreadable or empty file
+        return None
+
+def get_face_detector_config():
+    """(model path, backend, target) for YuNet, or None when the detector is unavailable."""
+    return face_detection.get_face_detector_config(app.config['FACE_DETECTOR_MODEL'], app.config['DETECTOR_CPU_FP16'])
+
+def create_face_detector():
+    """Create and warm up a YuNet face detector, or return None to use the Haar cascade."""
+    return face_detection.create_face_detector(app.config['FACE_DETECTOR_MODEL'], app.config['DETECTOR_CPU_FP16'])
+
+def init_face_detectors(count):
+    """Fill the detector pool so no request thread loads or warms a detector itself."""
+    config = get_face_detector_config()
+    if config is None:
+        logger.info("YuNet detector model not available, using Haar cascade")
+        return
+    for _ in range(count):
+        face_detector_pool.put(create_face_detector())
+    logger.info(f"Loaded {count} YuNet face detectors from {config[0]}")
+
+def detect_faces(img):
+    """Detect faces in a BGR image, largest first.
+
+    Returns a list of ((x, y, w, h), landmarks) tuples. With the YuNet detector
+    landmarks is a (5, 2) array in ARCFACE_TEMPLATE order; with the Haar
+    cascade it is None.
+    """
+    # Detect on a downscaled copy; boxes and landmarks are mapped back to img
+    h, w = img.shape[:2]
+    scale = min(1.0, DETECTION_MAX_SIDE / max(h, w))
+    small = img if scale == 1.0 else cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    try:
+        face_detector = face_detector_pool.get_nowait()
+    except queue.Empty:
+        # More concurrent detections than pooled detectors; the new one joins the pool
+        face_detector = create_face_detector()
+
+    if face_detector is not None:
+        # The input size must match each image; YuNet works on the color image directly
+        try:
+            face_detector.setInputSize((small.shape[1], small.shape[0]))
+            _, detections = face_detector.detect(small)
+        finally:
+            face_detector_pool.put(face_detector)
+        if detections is None:
+            return []
+        faces = [(tuple(int(v / scale) for v in det[:4]), det[4:14].reshape(5, 2) / scale) for det in detections]
+    else:
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        faces = [(tuple(int(v / scale) for v in box), None) for box in face_cascade.detectMultiScale(gray, 1.3, 5)]
+
+    # Sort faces by area (width * height) in descending order
+    return sorted(faces, key=lambda face: face[0][2] * face[0][3], reverse=True)
+
+def crop_face(img, box, landmarks=None):
+    """Crop a detected face, aligned to the ArcFace template when ALIGN_FACES is on."""
+    x, y, w, h = box
+    x, y = max(x, 0), max(y, 0)
+    face = img[y:y+h, x:x+w]
+    if not app.config['ALIGN_FACES']:
+        return face
+    if landmarks is not None:
+        aligned = warp_to_template(img, landmarks, ARCFACE_TEMPLATE)
+        if aligned is not None:
+            return aligned
+    return align_face(face)
+
+def align_reference(face_img):
+    """Align a stored (unaligned) reference face crop the same way probes are aligned.
+
+    References go through the same detector and landmarks as probes so both
+    land on the template identically; dlib's landmarks via align_face are only
+    the fallback when the detector gives none.
+    """
+    faces = detect_faces(face_img)
+    if faces and faces[0][1] is not None:
+        return crop_face(face_img, *faces[0])
+    return align_face(face_img)
+
+# Most recent debug face files, oldest first; older ones are deleted so TEMP_DIR stays bounded
+debug_face_paths = deque()
+debug_face_lock = threading.Lock()
+
+def save_debug_face(path, face_img):
+    """Write a probe face crop off the request thread when DEBUG_SAVE_FACES is on.
+
+    Only the last DEBUG_SAVE_MAX_FILES crops are kept.
+    """
+    if not app.config['DEBUG_SAVE_FACES']:
+        return
+    with debug_face_lock:
+        debug_face_paths.append(path)
+        stale = debug_face_paths.popleft() if len(debug_face_paths) > app.config['DEBUG_SAVE_MAX_FILES'] else None
+    io_executor.submit(write_jpeg, path, face_img.copy())
+    if stale is not None:
+        io_executor.submit(os.remove, stale)
 
 def extract_face_from_image(image_data):
     """Extract a face from an image."""
     # Decode base64 image
     try:
-        # Handle data URL format
-        if image_data.startswith('data:image'):
-            image_data = image_data.split(',', 1)[1]
-        
-        image_bytes = base64.b64decode(image_data)
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        image_bytes = decode_base64_image(image_data)
+    except Exception as e:
+        return None, f"Error decoding image: {str(e)}"
+    
+    return extract_face_from_bytes(image_bytes)
+
+def extract_face_from_bytes(image_bytes):
+    """Extract a face from encoded image bytes."""
+    try:
+        img = decode_image_bytes(image_bytes)
         
         if img is None:
             return None, "Failed to decode image data"
     except Exception as e:
         return None, f"Error decoding image: {str(e)}"
     
-    # Convert to grayscale for face detection
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
+    return extract_face_from_bgr(img)
+
+def extract_face_from_bgr(img):
+    """Extract the largest face from a decoded BGR image."""
     # Detect faces
-    faces = face_cascade.detectMultiScale(gray, 1.3, 5)
+    faces = detect_faces(img)
     if len(faces) == 0:
         return None, "No face detected in the image"
     if len(faces) > 1:
         logger.warning(f"Multiple faces detected. Using the largest face.")
     
-    # Sort faces by area (width * height) in descending order
-    faces = sorted(faces, key=lambda x: x[2] * x[3], reverse=True)
-    
     # Extract the largest face
-    x, y, w, h = faces[0]
-    face = img[y:y+h, x:x+w]
+    face = crop_face(img, *faces[0])
     
     return face, None
 
 def verify_face(user_id, face_img):
     """Verify a face against stored references for a user."""
-    metadata = load_metadata()
-    
     # Check if user exists
-    if user_id not in metadata:
+    if user_id not in metadata_store:
         return False, "User not found"
     
-    user_data = metadata[user_id]
-    if not user_data.get("images"):
+    references = metadata_store.get_references(user_id)
+    if not references:
         return False, "No reference images for user"
     
+    # Make sure every reference image of the user is in the index
+    if index_user_references(user_id, references):
+        reference_index.save()
+
     # Get embedding for the provided face
-    face_embedding = get_face_embedding(face_img)
-    
-    # Compare with all reference images
+    face_embedding = get_face_embedding(face_img, identity=f"user:{user_id}")
+
+    # The index returns hits best first, so only the top reference decides the result
     max_similarity = 0
     best_match = None
-    
-    for image_info in user_data["images"]:
-        image_path = image_info["path"]
-        if not os.path.exists(image_path):
-            logger.warning(f"Reference image not found: {image_path}")
-            continue
-        
-        # Load reference image
-        ref_img = cv2.imread(image_path)
-        if ref_img is None:
-            logger.warning(f"Failed to load reference image: {image_path}")
-            continue
-        
-        # Get embedding for reference face
-        ref_embedding = get_face_embedding(ref_img)
-        
-        # Compute similarity
-        similarity = compute_similarity(face_embedding, ref_embedding)
-        logger.info(f"Similarity with {os.path.basename(image_path)}: {similarity:.4f}")
-        
-        if similarity > max_similarity:
-            max_similarity = similarity
-            best_match = os.path.basename(image_path)
-    
+
+    for similarity, image_path in reference_index.search(user_id, face_embedding, k=1):
+        logger.debug(f"Similarity with {os.path.basename(image_path)}: {similarity:.4f}")
+        max_similarity = similarity
+        best_match = os.path.basename(image_path)
+
     # Determine verification result
     if max_similarity >= app.config['VERIFICATION_THRESHOLD']:
         logger.info(f"Verification successful for user {user_id} with similarity {max_similarity:.4f}")
@@ -647,29 +1681,58 @@ def verify_face(user_id, face_img):
             "threshold": app.config['VERIFICATION_THRESHOLD']
         }
 
+def load_voter_face(image_path):
+    """Read a voter's stored image as a face crop ready to embed, or None.
+
+    Stored voter images are usually the face crops written at enrollment
+    (already aligned when ALIGN_FACES is on); full photos, such as the sample
+    voters, are detected and cropped first.
+    """
+    img = read_image(image_path) if image_path else None
+    if img is None:
+        return None
+    if img.shape[0] == img.shape[1] and img.shape[0] in (ALIGNED_FACE_SIZE, 96):
+        return img  # Aligned crop, the size the embedding model takes
+    faces = detect_faces(img)
+    if faces:
+        return crop_face(img, *faces[0])
+    return align_face(img) if app.config['ALIGN_FACES'] else img
+
+def reembed_voter(voter_key, voter_record):
+    """Embed a voter's stored image with the current model and save it. Returns the embedding or None."""
+    face_img = load_voter_face(voter_record["image_path"])
+    if face_img is None:
+        return None
+    embedding = get_face_embedding(face_img)
+    voter_database.update_embedding(voter_key, embedding)
+    logger.info(f"Re-embedded voter {voter_key[:8]}... with {get_embedding_model_id()}")
+    return embedding
+
 def verify_voter_by_face(aadhar, voter_id, face_img):
     """Verify a voter by face against stored references by Aadhar and Voter ID."""
     voter_key = get_voter_key(aadhar, voter_id)
     
-    # Check if voter exists in database
-    if voter_key not in voter_database:
+    # Fetch the voter and their stored embedding in one lookup
+    voter_record, stored_embedding = voter_database.get_with_embedding(voter_key)
+    if voter_record is None:
         logger.warning(f"Voter not found: {voter_key[:8]}...")
         return False, "Voter not found"
+    if stored_embedding is None:
+        # Stored with another embedding model (e.g. the INT8 copy appeared or
+        # ALIGN_FACES changed); re-embed from the voter's enrolled image
+        stored_embedding = reembed_voter(voter_key, voter_record)
+        if stored_embedding is None:
+            logger.warning(f"No usable face embedding stored for voter: {voter_key[:8]}...")
+            return False, "Stored face for this voter is unavailable; re-enrollment required"
     
-    # Get voter record
-    voter_record = voter_database[voter_key]
-    
-    # Get embedding for the provided face
-    face_embedding = get_face_embedding(face_img)
-    
-    # Compare with stored embedding
-    stored_embedding = np.array(voter_record["embedding"])
+    # Get embedding for the provided face and compare
+    face_embedding = get_face_embedding(face_img, identity=f"voter:{voter_key}")
     similarity = compute_similarity(face_embedding, stored_embedding)
     
-    logger.info(f"Voter verification similarity: {similarity:.4f} (threshold: {VERIFICATION_THRESHOLD})")
+    logger.info(f"Voter verification similarity: {similarity:.4f} (threshold: {app.config['VERIFICATION_THRESHOLD']})")
     
     # Determine verification result
-    if similarity >= VERIFICATION_THRESHOLD:
+    if similarity >= app.config['VERIFICATION_THRESHOLD']:
         logger.info(f"Verification successful for voter with key: {voter_key[:8]}...")
         return True, {
             "match": True,
@@ -681,7 +1744,7 @@ def verify_voter_by_face(aadhar, voter_id, face_img):
         return False, {
             "match": False,
             "similarity": float(similarity),
-            "threshold": VERIFICATION_THRESHOLD
+            "threshold": app.config['VERIFICATION_THRESHOLD']
         }
 
 def api_auth_required(f):
@@ -695,12 +1758,14 @@ def api_auth_required(f):
         
         # Check if this is our Groq API key or development keys
         valid_keys = [
-            GROQ_API_KEY,  # The Groq API key
+            app.config['GROQ_API_KEY'],  # The Groq API key
             "dev_facial_auth_key",  # Development key
             "voting_system_dev_key"  # Alternative development key
         ]
         
-        if api_key not in valid_keys:
+        # Compare against every key in constant time
+        matches = [hmac.compare_digest(api_key.encode(), key.encode()) for key in valid_keys if key]
+        if not any(matches):
             return jsonify({"error": "Invalid API key"}), 401
             
         return f(*args, **kwargs)
@@ -711,11 +1776,28 @@ def health_check():
     """Health check endpoint."""
     return jsonify({
         "status": "ok",
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": now_iso(),
         "service": "facial-auth-api",
-        "groq_api": "configured" if GROQ_API_KEY else "not configured"
+        "groq_api": "configured" if app.config['GROQ_API_KEY'] else "not configured"
     })
 
+@app.route('/api/stats', methods=['GET'])
+@api_auth_required
+def get_stats():
+    """Embedding cache statistics for this worker process."""
+    with embedding_cache_lock:
+        return jsonify({
+            "embedding_cache": {
+                "hits": embedding_cache_stats["hits"],
+                "misses": embedding_cache_stats["misses"],
+                "phash_hits": embedding_cache_stats["phash_hits"],
+                "size": len(embedding_cache),
+                "max_size": embedding_cache.maxsize
+            },
+            "pid": os.getpid(),
+            "timestamp": now_iso()
+        })
+
 @app.route('/api/auth/verify', methods=['POST'])
 @api_auth_required
 def verify_user():
@@ -738,9 +1820,8 @@ def verify_user():
         if error:
             return jsonify({"error": error}), 400
         
-        # Save the processed face temporarily (for debugging)
-        temp_path = os.path.join(TEMP_DIR, f"verify_{user_id}_{uuid.uuid4()}.jpg")
-        cv2.imwrite(temp_path, face_img)
+        # Save the processed face (debugging only)
+        save_debug_face(os.path.join(app.config['TEMP_DIR'], f"verify_{user_id}_{uuid.uuid4()}.jpg"), face_img)
         
         # Verify the face
         verified, details = verify_face(user_id, face_img)
@@ -748,7 +1829,7 @@ def verify_user():
         response = {
             "verified": verified,
             "details": details,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": now_iso()
         }
         
         return jsonify(response)
@@ -784,9 +1865,7 @@ def verify_voter():
         # Generate a unique ID for this verification
         verification_id = str(uuid.uuid4())
         
-        # Save the processed face temporarily (for debugging)
-        temp_path = os.path.join(TEMP_DIR, f"voter_verify_{verification_id}.jpg")
-        cv2.imwrite(temp_path, face_img)
+        temp_path = os.path.join(app.config['TEMP_DIR'], f"voter_verify_{verification_id}.jpg")
         
         # Verify the voter
         verified, details = verify_voter_by_face(aadhar, voter_id, face_img)
@@ -795,6 +1874,8 @@ def verify_voter():
         voter_key = get_voter_key(aadhar, voter_id)
         if voter_key not in voter_database and not verified:
             logger.info(f"New voter registration: {voter_key[:8]}...")
+            # The saved face becomes the voter's reference image, so write it now
+            write_jpeg(temp_path, face_img)
             # Register the voter for future verifications
             register_voter(aadhar, voter_id, get_face_embedding(face_img), temp_path)
             verified = True
@@ -804,11 +1885,14 @@ def verify_voter():
                 "voter_id": voter_id,
                 "newly_registered": True
             }
+        else:
+            # Save the processed face (debugging only)
+            save_debug_face(temp_path, face_img)
         
         response = {
             "verified": verified,
             "details": details,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": now_iso(),
             "verification_id": verification_id
         }
         
@@ -822,14 +1906,13 @@ def verify_voter():
 def list_users():
     """List all registered users."""
     try:
-        metadata = load_metadata()
         users = []
         
-        for user_id, data in metadata.items():
+        for user_id, created, image_count in metadata_store.list_users():
             user_info = {
                 "userId": user_id,
-                "created": data.get("created"),
-                "imageCount": len(data.get("images", []))
+                "created": created,
+                "imageCount": image_count
             }
             users.append(user_info)
         
@@ -908,18 +1991,19 @@ def compare_face_for_vote():
              logger.error(f"Error generating embedding for live image: {e}")
              return jsonify({"error": f"Server error during embedding generation: {str(e)}"}), 500
 
-        # Compute similarity
-        similarity = compute_similarity(live_embedding, reference_embedding)
+        # Both embeddings are unit length, so this is a single dot product
+        similarity = float(compute_similarity(live_embedding, reference_embedding))
         logger.info(f"Comparison similarity: {similarity:.4f}")
 
         # Determine match based on threshold
-        is_match = similarity >= VERIFICATION_THRESHOLD
+        threshold = app.config['VERIFICATION_THRESHOLD']
+        is_match = similarity >= threshold
 
         response = {
             "match": is_match,
-            "similarity": float(similarity),
-            "threshold": VERIFICATION_THRESHOLD,
-            "timestamp": datetime.now().isoformat()
+            "similarity": similarity,
+            "threshold": threshold,
+            "timestamp": now_iso()
         }
 
         return jsonify(response)
@@ -953,53 +2037,105 @@ def add_voter():
         if error:
             return jsonify({"error": error}), 400
         
-        # Save the processed face
+        # Save the processed face on the I/O pool while the embedding is computed
         voter_key = get_voter_key(aadhar, voter_id)
         filename = f"{voter_key[:8]}_{uuid.uuid4()}.jpg"
-        image_path = os.path.join(IMAGES_DIR, filename)
-        cv2.imwrite(image_path, face_img)
+        image_path = os.path.join(app.config['IMAGES_DIR'], filename)
+        write_future = io_executor.submit(write_jpeg, image_path, face_img)
         
-        # Get embedding and register voter
+        # Get embedding and register voter once the image is on disk
         embedding = get_face_embedding(face_img)
+        write_future.result()
         register_voter(aadhar, voter_id, embedding, image_path)
         
         return jsonify({
             "success": True,
             "voter_key": voter_key[:8] + "...",
             "message": "Voter added successfully",
-            "timestamp": datetime.now().isoformat()
+            "timestamp": now_iso()
         })
     except Exception as e:
         logger.error(f"Error adding voter: {str(e)}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+@app.route('/api/voters/batch', methods=['POST'])
+@api_auth_required
+def add_voters_batch():
+    """Add several voters from one multipart request.
+
+    Expects parallel `aadhar`, `voterId` and `faces` fields. Faces are decoded
+    and detected on the I/O pool and embedded together in a single batch.
+    """
+    try:
+        aadhars = request.form.getlist('aadhar')
+        voter_ids = request.form.getlist('voterId')
+        files = request.files.getlist('faces')
+        
+        if not files:
+            return jsonify({"error": "At least one face image is required"}), 400
+        if not len(aadhars) == len(voter_ids) == len(files):
+            return jsonify({"error": "aadhar, voterId and faces must have the same number of entries"}), 400
+        if len(files) > app.config['VOTER_BATCH_MAX']:
+            return jsonify({"error": f"At most {app.config['VOTER_BATCH_MAX']} voters per batch"}), 400
+        
+        # Decode and detect faces in parallel
+        extracted = list(io_executor.map(extract_face_from_bytes, [f.read() for f in files]))
+        
+        results = [None] * len(files)
+        pending = []
+        for i, (aadhar, voter_id, (face_img, error)) in enumerate(zip(aadhars, voter_ids, extracted)):
+            if not aadhar or not voter_id:
+                error = "Aadhar number and voter ID are required"
+            if error:
+                results[i] = {"index": i, "success": False, "error": error}
+            else:
+                pending.append((i, aadhar, voter_id, face_img))
+        
+        if pending:
+            # Save faces on the I/O pool while the whole batch is embedded at once
+            writes = []
+            for i, aadhar, voter_id, face_img in pending:
+                voter_key = get_voter_key(aadhar, voter_id)
+                image_path = os.path.join(app.config['IMAGES_DIR'], f"{voter_key[:8]}_{uuid.uuid4()}.jpg")
+                writes.append((image_path, io_executor.submit(write_jpeg, image_path, face_img)))
+            
+            embeddings = get_face_embeddings([face_img for _, _, _, face_img in pending])
+            
+            for (i, aadhar, voter_id, _), embedding, (image_path, write_future) in zip(pending, embeddings, writes):
+                if write_future.exception() is not None:
+                    results[i] = {"index": i, "success": False, "error": "Failed to save face image"}
+                    continue
+                voter_key = register_voter(aadhar, voter_id, embedding, image_path)
+                results[i] = {"index": i, "success": True, "voter_key": voter_key[:8] + "..."}
+        
+        added = sum(1 for r in results if r["success"])
+        logger.info(f"Batch added {added}/{len(files)} voters")
+        return jsonify({
+            "success": added > 0,
+            "added": added,
+            "results": results,
+            "timestamp": now_iso()
+        })
+    except Exception as e:
+        logger.error(f"Error adding voter batch: {str(e)}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
 
 @app.route('/api/users/<user_id>', methods=['GET'])
 @api_auth_required
 def get_user(user_id):
     """Get information about a specific user."""
     try:
-        metadata = load_metadata()
+        user_data = metadata_store.get_user(user_id)
         
-        if user_id not in metadata:
+        if user_data is None:
             return jsonify({"error": "User not found"}), 404
         
-        user_data = metadata[user_id]
-        images = []
-        
-        for img_info in user_data.get("images", []):
-            # Don't include the full path in the response
-            file_name = os.path.basename(img_info.get("path", ""))
-            images.append({
-                "filename": file_name,
-                "added": img_info.get("added"),
-                "source": img_info.get("source")
-            })
-        
+        # Paths and embeddings are not included in the response
         return jsonify({
             "userId": user_id,
-            "created": user_data.get("created"),
-            "images": images
+            "created": user_data["created"],
+            "images": user_data["images"]
         })
     except Exception as e:
         logger.error(f"Error getting user {user_id}: {str(e)}")
@@ -1010,17 +2146,10 @@ def get_user(user_id):
 def get_random_voter():
     """Get a random voter for testing."""
     try:
-        if not voter_database:
-            # If database is empty, add sample data
-            load_sample_data()
-            
-        if not voter_database:
-            return jsonify({"error": "No voters available"}), 404
-            
-        # Get a random voter
-        import random
-        voter_key = random.choice(list(voter_database.keys()))
-        voter_data = voter_database[voter_key]
+        item = voter_database.random_item()
+        if item is None:
+            return jsonify({"error": "No voters enrolled"}), 404
+        _, voter_data = item
         
         return jsonify({
             "aadhar": voter_data["aadhar"],
@@ -1045,17 +2174,23 @@ def verify_credentials():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/auth/verify-face', methods=['POST'])
-def verify_face():
+@app.route('/api/auth/verify-face', methods=['POST'], endpoint='verify_face')
+def verify_face_endpoint():
     try:
-        data = request.json
-        image_data = data.get('imageData')
-        aadhar_number = data.get('aadharNumber')
+        if 'image' in request.files:
+            # Multipart upload: the image arrives as raw bytes, no base64 round-trip
+            image_bytes = request.files['image'].read()
+            aadhar_number = request.form.get('aadharNumber')
+        else:
+            data = request.json
+            image_data = data.get('imageData')
+            aadhar_number = data.get('aadharNumber')
+            image_bytes = decode_base64_image(image_data) if image_data else None
 
-        if not image_data or not aadhar_number:
+        if not image_bytes or not aadhar_number:
             return jsonify({'error': 'Missing required data'}), 400
 
-        result = face_verifier.verify_face(image_data, aadhar_number)
+        result = face_verifier.verify_face(image_bytes, aadhar_number)
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1072,38 +2207,67 @@ def register_face():
         if not all([image_data, aadhar_number, voter_id, mobile_number]):
             return jsonify({'error': 'Missing required data'}), 400
 
-        # Decode and process image
-        image_bytes = base64.b64decode(image_data.split(',')[1])
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-        # Get face encoding
-        face_locations = face_recognition.face_locations(rgb_image)
-        if not face_locations:
+        # Decode the image and get its face encoding
+        face_encoding = get_face_recognition_encoding(decode_base64_image(image_data))
+        if face_encoding is None:
             return jsonify({'error': 'No face detected'}), 400
 
-        face_encoding = face_recognition.face_encodings(rgb_image, face_locations)[0]
-
         # Store in database
-        conn = sqlite3.connect('voter_verification.db')
-        c = conn.cursor()
-        c.execute('''
+        conn = get_db_connection()
+        conn.execute('''
             INSERT OR REPLACE INTO voter_verification
             (aadhar_number, voter_id, mobile_number, face_encoding, verification_time)
             VALUES (?, ?, ?, ?, ?)
-        ''', (aadhar_number, voter_id, mobile_number, face_encoding.tobytes(), datetime.now()))
+        ''', (aadhar_number, voter_id, mobile_number, face_encoding.astype(np.float16).tobytes(), datetime.now()))
         conn.commit()
-        conn.close()
-
-        # Update in-memory cache
-        face_verifier.known_face_encodings[aadhar_number] = face_encoding
 
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Error registering face: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@lru_cache(maxsize=256)
+def get_reference_image_embedding(image_path, mtime_ns, model_id):
+    """Embedding of the face in a reference image; mtime_ns and model_id key out stale entries."""
+    face_img = load_voter_face(image_path)
+    if face_img is None:
+        raise ValueError(f"Could not read image: {image_path}")
+    return get_face_embedding(face_img)
+
+@lru_cache(maxsize=64)
+def read_reference_bytes(image_path, mtime_ns):
+    """Encoded bytes of a reference image; mtime_ns keys out files that were replaced."""
+    with open(image_path, 'rb') as f:
+        return f.read()
+
+def local_face_similarity(captured_image_b64, reference_image_path, voter=None):
+    """Cosine similarity of the captured face to the reference with the local model, or None.
+
+    voter is the (voter_key, record) the reference belongs to, if any; its
+    stored embedding is used instead of embedding the image again. Only the
+    pretrained ONNX model is trusted to settle a comparison, so this returns
+    None (defer to Face++) with the Keras model or Groq embeddings, or when
+    either face cannot be embedded.
+    """
+    if app.config['USE_GROQ_API'] or face_session is None:
+        return None
+    try:
+        live_face, error = extract_face_from_image(captured_image_b64)
+        if error:
+            return None
+        reference = None
+        if voter is not None:
+            reference = voter_database.get_embedding(voter[0])
+            if reference is None:
+                reference = reembed_voter(*voter)
+        if reference is None:
+            reference = get_reference_image_embedding(reference_image_path, os.stat(reference_image_path).st_mtime_ns,
+                                                      get_embedding_model_id())
+        return float(compute_similarity(get_face_embedding(live_face), reference))
+    except Exception as e:
+        logger.warning(f"Local pre-filter failed, deferring to Face++: {str(e)}")
+        return None
+
 # --- New Face++ Match Endpoint ---
 @app.route('/api/face-match', methods=['POST'])
 @limiter.limit("10 per minute") # Add rate limiting
@@ -1133,13 +2297,11 @@ def face_match_endpoint():
         # In a real app, fetch from DB based on userId/voterId
         # For now, use the sample data logic or a default
         reference_image_path = None
-        # Check sample data first (development)
-        for key, voter_data in voter_database.items():
-             # Use voter_id for matching as it's more likely unique from frontend perspective
-            if voter_data.get("voter_id") == voter_id or voter_data.get("voter_id") == user_id:
-                reference_image_path = voter_data.get("image_path")
-                logger.info(f"Found reference image path for {user_id}/{voter_id} in sample data: {reference_image_path}")
-                break
+        # Use voter_id for matching as it's more likely unique from frontend perspective
+        voter = voter_database.find_by_voter_id(voter_id, user_id)
+        if voter is not None:
+            reference_image_path = voter[1]["image_path"]
+            logger.info(f"Found reference image path for {user_id}/{voter_id} in voter database: {reference_image_path}")
 
         # Fallback if not in sample data (or if sample data loading failed)
         if not reference_image_path:
@@ -1151,6 +2313,10 @@ def face_match_endpoint():
              logger.error(f"Reference image path not found or invalid: {reference_image_path}")
              return jsonify({"success": False, "message": f"Reference image not found for user {user_id}"}), 404
 
+        # Read the reference on the I/O pool while the captured image is processed
+        reference_future = io_executor.submit(read_reference_bytes, reference_image_path,
+                                              os.stat(reference_image_path).st_mtime_ns)
+
         # --- Prepare Face++ API Call ---
         api_key = app.config.get('FACE_API_KEY')
         api_secret = app.config.get('FACE_API_SECRET')
@@ -1160,35 +2326,50 @@ def face_match_endpoint():
             logger.error("Face++ API Key or Secret not configured in environment.")
             return jsonify({"success": False, "message": "Server configuration error: Face++ credentials missing."}), 500
 
+        # Clear matches and clear mismatches are settled locally; only the
+        # ambiguous band between them pays for the Face++ round-trip
+        similarity = local_face_similarity(captured_image_b64, reference_image_path, voter)
+        if similarity is not None and not (app.config['FACEPP_LOCAL_REJECT'] <= similarity <= app.config['FACEPP_LOCAL_MATCH']):
+            is_match = similarity > app.config['FACEPP_LOCAL_MATCH']
+            logger.info(f"Local verification for {user_id} completed in {time.time() - start_time:.2f}s. Match: {is_match}, Similarity: {similarity:.4f}")
+            return jsonify({
+                "success": True,
+                "message": "Verification check complete",
+                "data": {
+                    "isMatch": is_match,
+                    "confidence": similarity * 100,  # On the Face++ 0-100 scale
+                    "threshold": float(app.config['FACEPLUSPLUS_CONFIDENCE_THRESHOLD']),
+                    "livenessConfirmed": None,
+                    "spoofingDetected": None,
+                    "processing": {
+                        "faceDetected": True,
+                        "localSimilarity": similarity
+                    }
+                }
+            })
+
         payload = {
             'api_key': api_key,
             'api_secret': api_secret,
-            'image_base64_1': captured_image_b64.split(',', 1)[1] if captured_image_b64.startswith('data:') else captured_image_b64,
+            'image_base64_1': captured_image_b64[captured_image_b64.find(',') + 1:] if captured_image_b64.startswith('data:') else captured_image_b64,
             # 'image_url2': 'URL_OF_REFERENCE_IMAGE', # Option 1: If reference is URL
             # 'image_base64_2': 'BASE64_OF_REFERENCE_IMAGE', # Option 2: If reference is base64
             # 'face_token1': 'TOKEN_FROM_DETECT', # Option 3: Using face tokens
             # 'face_token2': 'TOKEN_FROM_DETECT'
         }
 
-        files = {
-             'image_file2': (os.path.basename(reference_image_path), open(reference_image_path, 'rb'), 'image/jpeg')
-             # Sending reference image as file upload
-        }
-
         logger.info(f"Calling Face++ Compare API for user {user_id} against {os.path.basename(reference_image_path)}")
 
         # --- Make API Call ---
         try:
-            response = requests.post(api_url, data=payload, files=files, timeout=15) # Added timeout
+            # Send the reference image as a file upload
+            files = {'image_file2': (os.path.basename(reference_image_path), reference_future.result(), 'image/jpeg')}
+            response = http_session.post(api_url, data=payload, files=files, timeout=15) # Added timeout
             response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-            faceplusplus_result = response.json()
+            faceplusplus_result = orjson.loads(response.content)
         except requests.exceptions.RequestException as e:
              logger.error(f"Face++ API request failed: {str(e)}")
              return jsonify({"success": False, "message": f"Failed to connect to Face++ API: {str(e)}"}), 503 # Service Unavailable
-        finally:
-             # Ensure file handle is closed
-             if 'image_file2' in files:
-                 files['image_file2'][1].close()
 
 
         # --- Process Face++ Response ---
@@ -1240,29 +2421,59 @@ def face_match_endpoint():
         return jsonify({"success": False, "message": f"Internal server error: {str(e)}"}), 500
 
 
-# --- Main Execution ---
-if __name__ == "__main__":
+# --- Startup ---
+_init_lock = threading.Lock()
+_initialized = False
+
+def init():
+    """Load models, the reference index and extra endpoints once per process.
+
+    Called from __main__ for the development server and from gunicorn's
+    post_worker_init hook, so each worker initializes after it is forked.
+    """
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        _init()
+        _initialized = True
+
+def _init():
     # Initialize face recognition model (if not using Groq API or Face++)
     if not app.config['USE_GROQ_API'] and not app.config['FACE_API_KEY']:
         logger.info("Initializing local face model as neither Groq nor Face++ is configured.")
         init_face_model()
+    elif app.config['FACE_API_KEY'] and not app.config['USE_GROQ_API'] and use_onnx_model():
+        # /api/face-match settles clear cases with the pretrained model before calling Face++
+        logger.info("Face++ API is configured. Loading the ONNX face model for the local pre-filter.")
+        init_face_model()
     elif app.config['FACE_API_KEY']:
         logger.info("Face++ API is configured. Local model/Groq will not be used for primary verification.")
     elif app.config['USE_GROQ_API']:
          logger.info("Groq API is configured. Local model will not be used.")
 
+    init_face_detectors(app.config['DETECTOR_POOL_SIZE'])
+
+    # JIT-compile the small-gallery similarity kernel now rather than on the first verification
+    if dot_rows is not None:
+        dot_rows(np.zeros(1, np.float32), np.zeros((1, 1), np.float32), np.empty(1, np.float32))
+
+    # Embed reference images once so verification only embeds the probe face
+    build_reference_index()
+
     # Load the reference embedding at startup (only needed for local compare)
     # load_reference_embedding() # Commented out as Face++ handles comparison
     
-    # Load sample data for development (still useful for user info lookup)
-    load_sample_data()
+    # Load sample voters only when asked; they persist in VOTER_DB_PATH once loaded
+    if app.config['LOAD_SAMPLES']:
+        load_sample_data()
 
     # Import and register authentication endpoints (ensure they don't conflict)
     try:
         # Check if auth_handlers exists and has the function
         if 'auth_handlers' in sys.modules and hasattr(sys.modules['auth_handlers'], 'register_endpoints'):
             import auth_handlers
-            app = auth_handlers.register_endpoints(
+            auth_handlers.register_endpoints(
                 app,
                 api_auth_required,
                 voter_database,
@@ -1271,7 +2482,9 @@ if __name__ == "__main__":
                 verify_voter_by_face, # This uses local/Groq, might need update for Face++
                 get_face_embedding,   # This uses local/Groq
                 register_voter,       # This uses local/Groq
-                TEMP_DIR
+                app.config['TEMP_DIR'],
+                save_debug_face,
+                write_jpeg
             )
             logger.info("Successfully registered additional authentication endpoints from auth_handlers")
         else:
@@ -1281,10 +2494,24 @@ if __name__ == "__main__":
     # Removed duplicated block here
     except Exception as e:
         logger.error(f"Error registering authentication endpoints from auth_handlers: {str(e)}") # Clarified error source
-    
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Facial authentication server")
+    parser.add_argument("--prepare-face-model", action="store_true",
+                        help="Calibrate the INT8 face model and build cached engines, then exit")
+    args = parser.parse_args()
+    if args.prepare_face_model:
+        prepare_face_model()
+        sys.exit(0)
+
+    init()
+
     # Start the server
     port = int(os.getenv("PORT", 5000)) # Use port 5000 as expected by frontend config
-    debug_mode = os.getenv("FLASK_ENV", "development") == "development"
+    debug_mode = os.getenv("FLASK_DEBUG", "false").lower() == "true"
     logger.info(f"Starting Facial Auth Server on port {port} (Debug: {debug_mode})")
-    # Use waitress or gunicorn in production instead of Flask's built-in server
-    app.run(host="0.0.0.0", port=port, debug=debug_mode)
+    # Use gunicorn (gunicorn_conf.py) in production instead of Flask's built-in server.
+    # The reloader would re-run this module in a child process and load every model twice.
+    app.run(host="0.0.0.0", port=port, debug=debug_mode, use_reloader=False)
@@ -0,0 +1,39 @@
+"""
+Gunicorn configuration for the facial authentication server
+
+Usage:
+  gunicorn -c gunicorn_conf.py facial_auth_server:app
+
+Threaded workers let blocking Groq/Face++ calls and model forwards overlap,
+and give the embedding batcher concurrent requests to coalesce. gevent is not
+used because monkey-patching does not cooperate with TensorFlow, onnxruntime
+or the batcher's native threads.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Each worker loads its own copy of the models. When they run on a single GPU,
+# use GUNICORN_WORKERS=1 so all request threads share one GPU context.
+workers = int(os.getenv("GUNICORN_WORKERS", max(2, (os.cpu_count() or 2) // 2)))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+# dlib, OpenCV and NumPy release the GIL, so request threads already run in
+# parallel; one BLAS/OpenMP thread each keeps them from oversubscribing cores
+for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(var, "1")
+
+# Workers load, compile and warm up the models before accepting requests
+timeout = 120
+
+# preload_app stays off: TensorFlow/CUDA contexts, onnxruntime sessions,
+# SQLite connections and pool threads do not survive fork(), so each worker
+# initializes itself once it has been forked.
+preload_app = False
+
+
+def post_worker_init(worker):
+    from facial_auth_server import init
+    init()
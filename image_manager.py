@@ -17,13 +17,15 @@ import sys
 import argparse
 import shutil
 import time
-import json
+import uuid
 from datetime import datetime
 
 try:
     import cv2
     import numpy as np
     from PIL import Image
+    from metadata_store import MetadataStore
+    from face_detection import create_face_detector
 except ImportError:
     print("Required libraries not found. Please install with:")
     print("pip install opencv-python pillow numpy")
@@ -31,28 +33,41 @@ except ImportError:
 
 # Configuration
 IMAGES_DIR = "images/users"
-METADATA_FILE = f"{IMAGES_DIR}/metadata.json"
+METADATA_DB = f"{IMAGES_DIR}/metadata.db"
+METADATA_FILE = f"{IMAGES_DIR}/metadata.json"  # Legacy metadata, imported once into METADATA_DB
+FACE_DETECTOR_MODEL = os.getenv("FACE_DETECTOR_MODEL", "models/face_detection_yunet_2023mar.onnx")
+DETECTOR_CPU_FP16 = os.getenv("DETECTOR_CPU_FP16", "false").lower() == "true"
 FACE_CASCADE = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
 
+FACE_DETECTOR = create_face_detector(FACE_DETECTOR_MODEL, DETECTOR_CPU_FP16)
+
+def detect_faces(img):
+    """Detect faces in a BGR image and return (x, y, w, h) boxes, largest first."""
+    if FACE_DETECTOR is not None:
+        # YuNet works on the color image directly; the input size must match each image
+        FACE_DETECTOR.setInputSize((img.shape[1], img.shape[0]))
+        _, detections = FACE_DETECTOR.detect(img)
+        faces = [] if detections is None else [tuple(max(int(v), 0) for v in det[:4]) for det in detections]
+    else:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        faces = [tuple(box) for box in FACE_CASCADE.detectMultiScale(gray, 1.3, 5)]
+
+    # Sort faces by area (width * height) in descending order
+    return sorted(faces, key=lambda x: x[2] * x[3], reverse=True)
+
+metadata_store = None
+
 def ensure_directories():
     """Ensure the required directories exist."""
     os.makedirs(IMAGES_DIR, exist_ok=True)
-    if not os.path.exists(METADATA_FILE):
-        with open(METADATA_FILE, 'w') as f:
-            json.dump({}, f)
-
-def load_metadata():
-    """Load the user metadata."""
-    with open(METADATA_FILE, 'r') as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return {}
-
-def save_metadata(metadata):
-    """Save the user metadata."""
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(metadata, f, indent=2)
+
+def get_metadata_store():
+    """Open the user metadata database, importing metadata.json on first use."""
+    global metadata_store
+    if metadata_store is None:
+        ensure_directories()
+        metadata_store = MetadataStore(METADATA_DB, METADATA_FILE)
+    return metadata_store
 
 def add_user(user_id, image_path):
     """Add a new user with a reference image."""
@@ -66,20 +81,14 @@ def add_user(user_id, image_path):
         print(f"Error: Could not read image: {image_path}")
         return False
     
-    # Convert to grayscale for face detection
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
     # Detect faces
-    faces = FACE_CASCADE.detectMultiScale(gray, 1.3, 5)
+    faces = detect_faces(img)
     if len(faces) == 0:
         print("Error: No face detected in the image.")
         return False
     if len(faces) > 1:
         print("Warning: Multiple faces detected. Using the largest face.")
     
-    # Sort faces by area (width * height) in descending order
-    faces = sorted(faces, key=lambda x: x[2] * x[3], reverse=True)
-    
     # Extract the largest face
     x, y, w, h = faces[0]
     face = img[y:y+h, x:x+w]
@@ -90,26 +99,12 @@ def add_user(user_id, image_path):
     
     # Save the extracted face
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    face_filename = f"{user_id}_{timestamp}.jpg"
+    face_filename = f"{user_id}_{timestamp}_{uuid.uuid4().hex[:8]}.jpg"
     face_path = os.path.join(user_dir, face_filename)
     cv2.imwrite(face_path, face)
     
     # Update metadata
-    metadata = load_metadata()
-    if user_id not in metadata:
-        metadata[user_id] = {
-            "created": datetime.now().isoformat(),
-            "images": []
-        }
-    
-    metadata[user_id]["images"].append({
-        "filename": face_filename,
-        "path": face_path,
-        "added": datetime.now().isoformat(),
-        "source": "imported"
-    })
-    
-    save_metadata(metadata)
+    get_metadata_store().add_image(user_id, face_filename, face_path, "imported")
     print(f"Successfully added user {user_id} with reference image.")
     return True
 
@@ -131,11 +126,8 @@ def capture_from_webcam(user_id):
             print("Error: Could not read frame from webcam.")
             break
         
-        # Convert to grayscale for face detection
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
         # Detect faces
-        faces = FACE_CASCADE.detectMultiScale(gray, 1.3, 5)
+        faces = detect_faces(frame)
         
         # Draw rectangle around detected faces
         for (x, y, w, h) in faces:
@@ -163,9 +155,6 @@ def capture_from_webcam(user_id):
         
         # SPACE key to capture
         if key == 32 and face_detected and len(faces) > 0:
-            # Sort faces by area (width * height) in descending order
-            faces = sorted(faces, key=lambda x: x[2] * x[3], reverse=True)
-            
             # Extract the largest face
             x, y, w, h = faces[0]
             face = frame[y:y+h, x:x+w]
@@ -176,26 +165,12 @@ def capture_from_webcam(user_id):
             
             # Save the extracted face
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            face_filename = f"{user_id}_{timestamp}.jpg"
+            face_filename = f"{user_id}_{timestamp}_{uuid.uuid4().hex[:8]}.jpg"
             face_path = os.path.join(user_dir, face_filename)
             cv2.imwrite(face_path, face)
             
             # Update metadata
-            metadata = load_metadata()
-            if user_id not in metadata:
-                metadata[user_id] = {
-                    "created": datetime.now().isoformat(),
-                    "images": []
-                }
-            
-            metadata[user_id]["images"].append({
-                "filename": face_filename,
-                "path": face_path,
-                "added": datetime.now().isoformat(),
-                "source": "webcam"
-            })
-            
-            save_metadata(metadata)
+            get_metadata_store().add_image(user_id, face_filename, face_path, "webcam")
             print(f"Successfully captured and added reference image for user {user_id}.")
             break
     
@@ -206,17 +181,17 @@ def capture_from_webcam(user_id):
 
 def list_users():
     """List all registered users."""
-    metadata = load_metadata()
-    if not metadata:
+    users = get_metadata_store().list_users()
+    if not users:
         print("No users found.")
         return
     
-    print(f"Total users: {len(metadata)}")
+    print(f"Total users: {len(users)}")
     print("-" * 50)
-    for user_id, data in metadata.items():
+    for user_id, created, image_count in users:
         print(f"User ID: {user_id}")
-        print(f"Created: {data['created']}")
-        print(f"Reference images: {len(data['images'])}")
+        print(f"Created: {created}")
+        print(f"Reference images: {image_count}")
         print("-" * 50)
 
 def main():
@@ -0,0 +1,44 @@
+"""
+orjson helpers for the Flask API
+
+Flask 2.0 has no pluggable JSON provider, so request and response bodies are
+routed through orjson here, along with the timestamp used in responses. Both
+the server and the authentication handlers import from this module.
+"""
+
+import time
+from datetime import datetime
+
+import orjson
+from flask import Request, Response
+
+
+class OrjsonRequest(Request):
+    """Request class whose request.json / get_json() parse with orjson."""
+    json_module = orjson
+
+
+def jsonify(*args, **kwargs):
+    """Drop-in replacement for flask.jsonify that serializes with orjson.
+
+    NumPy arrays and scalars are serialized natively.
+    """
+    if args and kwargs:
+        raise TypeError("jsonify() behavior undefined when passed both args and kwargs")
+    data = args[0] if len(args) == 1 else (list(args) or kwargs)
+    return Response(orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS),
+                    mimetype='application/json')
+
+
+_timestamp_cache = (0, "")  # (epoch second, formatted), replaced atomically
+
+
+def now_iso():
+    """Current local time as an ISO-8601 string, formatted at most once per second."""
+    global _timestamp_cache
+    second = int(time.time())
+    cached_second, formatted = _timestamp_cache
+    if cached_second != second:
+        formatted = datetime.fromtimestamp(second).isoformat()
+        _timestamp_cache = (second, formatted)
+    return formatted
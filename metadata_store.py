@@ -0,0 +1,147 @@
+"""
+SQLite store for reference image metadata
+
+Users and their reference images live in indexed tables instead of a single
+metadata.json, so looking up one user is a B-tree seek rather than a parse of
+every user, and adding an image is one INSERT rather than a rewrite of the
+whole file. Both the server and image_manager use this module.
+"""
+
+import base64
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime
+
+import orjson
+
+
+class MetadataStore:
+    """Users and reference images in SQLite.
+
+    Each image row may carry the cached float32 embedding of the face (raw
+    bytes) and the id of the model that produced it. The database runs in WAL
+    mode so readers never block on a write from another process.
+    """
+
+    def __init__(self, path, json_path=None):
+        self.path = path
+        self.local = threading.local()  # One connection per thread
+        with closing(sqlite3.connect(path)) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS users
+                (user_id TEXT PRIMARY KEY,
+                 created TEXT)
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS images
+                (id INTEGER PRIMARY KEY,
+                 user_id TEXT NOT NULL REFERENCES users(user_id),
+                 filename TEXT,
+                 path TEXT UNIQUE,
+                 added TEXT,
+                 source TEXT,
+                 embedding BLOB,
+                 embedding_model TEXT)
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS images_user_id ON images(user_id)')
+            conn.commit()
+            if json_path and os.path.exists(json_path):
+                self._import_json(conn, json_path)
+
+    @staticmethod
+    def _import_json(conn, json_path):
+        """One-shot migration from metadata.json; skipped once the database has users."""
+        # IMMEDIATE takes the write lock up front, so only one process imports
+        conn.execute('BEGIN IMMEDIATE')
+        if conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]:
+            conn.rollback()
+            return
+        with open(json_path, 'rb') as f:
+            try:
+                metadata = orjson.loads(f.read())
+            except orjson.JSONDecodeError:
+                metadata = {}
+        for user_id, user_data in metadata.items():
+            conn.execute('INSERT OR IGNORE INTO users VALUES (?, ?)', (user_id, user_data.get("created")))
+            for img in user_data.get("images", []):
+                embedding = img.get("embedding")
+                conn.execute('INSERT OR IGNORE INTO images (user_id, filename, path, added, source, embedding, embedding_model) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (user_id, img.get("filename") or os.path.basename(img.get("path", "")), img.get("path"),
+                              img.get("added"), img.get("source"),
+                              base64.b64decode(embedding) if embedding else None, img.get("embedding_model")))
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            self.local.conn = conn
+        return conn
+
+    def __contains__(self, user_id):
+        return self._connection().execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,)).fetchone() is not None
+
+    def add_image(self, user_id, filename, path, source):
+        """Add a reference image, creating the user on their first image."""
+        now = datetime.now().isoformat()
+        conn = self._connection()
+        conn.execute('INSERT OR IGNORE INTO users VALUES (?, ?)', (user_id, now))
+        # A file written to the same path replaces the old row and its cached embedding;
+        # the new row gets a new id, which tells the reference index to drop the old vector
+        conn.execute('INSERT OR REPLACE INTO images (user_id, filename, path, added, source) VALUES (?, ?, ?, ?, ?)',
+                     (user_id, filename, path, now, source))
+        conn.commit()
+
+    def list_users(self):
+        """Return (user_id, created, image count) for every user."""
+        return self._connection().execute(
+            'SELECT users.user_id, created, COUNT(images.id) FROM users '
+            'LEFT JOIN images ON images.user_id = users.user_id GROUP BY users.user_id').fetchall()
+
+    def get_user(self, user_id):
+        """Return {"created", "images"} for a user without paths or embeddings, or None."""
+        conn = self._connection()
+        row = conn.execute('SELECT created FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        if row is None:
+            return None
+        images = conn.execute('SELECT filename, added, source FROM images WHERE user_id = ? ORDER BY id', (user_id,))
+        return {
+            "created": row[0],
+            "images": [{"filename": filename, "added": added, "source": source} for filename, added, source in images]
+        }
+
+    def get_references(self, user_id):
+        """Return the user's reference images as {"id", "path", "embedding", "embedding_model"} dicts."""
+        rows = self._connection().execute(
+            'SELECT id, path, embedding, embedding_model FROM images WHERE user_id = ? ORDER BY id', (user_id,))
+        return [{"id": image_id, "path": path, "embedding": embedding, "embedding_model": model}
+                for image_id, path, embedding, model in rows]
+
+    def references_by_user(self):
+        """Return {user_id: references} for every user with reference images."""
+        references = {}
+        rows = self._connection().execute('SELECT user_id, id, path, embedding, embedding_model FROM images ORDER BY id')
+        for user_id, image_id, path, embedding, model in rows:
+            references.setdefault(user_id, []).append(
+                {"id": image_id, "path": path, "embedding": embedding, "embedding_model": model})
+        return references
+
+    def image_paths(self):
+        """Return the path of every reference image."""
+        return [row[0] for row in self._connection().execute('SELECT path FROM images')]
+
+    def image_ids(self):
+        """Return the id of every reference image row."""
+        return [row[0] for row in self._connection().execute('SELECT id FROM images')]
+
+    def set_embeddings(self, entries):
+        """Cache embeddings on their image rows from (image id, embedding bytes, model id) tuples."""
+        conn = self._connection()
+        # Keyed by id, so an embedding of a file that was since replaced never lands on the new row
+        conn.executemany('UPDATE images SET embedding = ?, embedding_model = ? WHERE id = ?',
+                         [(embedding, model_id, image_id) for image_id, embedding, model_id in entries])
+        conn.commit()
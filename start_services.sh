@@ -52,7 +52,7 @@ fi
 
 # Start the facial authentication server
 echo "Starting facial authentication server..."
-gunicorn --bind 0.0.0.0:5000 --workers 4 --timeout 120 facial_auth_server:app &
+gunicorn -c gunicorn_conf.py facial_auth_server:app &
 
 # Start the frontend server (if using Node.js)
 if [ -f "package.json" ]; then